@@ -0,0 +1,54 @@
+"""
+compares gathering from an AnnuityTable with computing the annuity formulas
+
+Run with python scripts/benchmark_tables.py. Timings depend on the machine,
+so they are reported here and not asserted in the unit tests.
+"""
+import timeit
+
+import numpy as np
+
+from mortgage_scenarios.tables import AnnuityTable
+from mortgage_scenarios.utils import get_annuity_payment, get_balance_after, \
+    get_monthly_rate
+
+####
+# Settings
+####
+n_rows = 1000000
+repeat = 5
+#####
+
+table = AnnuityTable.build(range(0, 1001), [10, 20, 30])
+rng = np.random.default_rng(0)
+rates = rng.integers(0, 1001, n_rows) / 10000
+terms = rng.choice([10, 20, 30], n_rows)
+periods = rng.integers(0, 121, n_rows)
+amounts = rng.uniform(1e5, 5e5, n_rows)
+
+
+def direct_payment():
+    return get_annuity_payment(get_monthly_rate(rates), terms * 12, amounts)
+
+
+def direct_balance():
+    monthly = get_monthly_rate(rates)
+    payment = get_annuity_payment(monthly, terms * 12, 1.)
+    return get_balance_after(monthly, periods, amounts, payment)
+
+
+def best(function, number=1):
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+print('{:,} rows'.format(n_rows))
+print('payment  table {:.4f}s  formulas {:.4f}s'.format(
+    best(lambda: table.payment(amounts, rates, terms)), best(direct_payment)))
+print('balance  table {:.4f}s  formulas {:.4f}s'.format(
+    best(lambda: table.balance(amounts, rates, terms, periods)), best(direct_balance)))
+print('off grid table {:.4f}s'.format(
+    best(lambda: table.payment(amounts, np.minimum(rates + 0.000005, 0.0999), terms))))
+print('scalar   table {:.1f}us  formulas {:.1f}us'.format(
+    best(lambda: table.payment(100000., 0.0215, 20), 10000) * 1e6,
+    best(lambda: get_annuity_payment(get_monthly_rate(0.0215), 240, 100000.),
+         10000) * 1e6))
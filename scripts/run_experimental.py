@@ -1,10 +1,9 @@
-from bisect import bisect
-
 import pandas as pd
 import numpy as np
 
 from mortgage_scenarios import MortgageLoanRunner, LoanPartIterator, get_monthly_rate
 from mortgage_scenarios.core import group_by_year
+from mortgage_scenarios.houseprice import LTV_BAND_NAMES, get_ltv_band
 
 """
 This script contains prototypes for experimental features 
@@ -39,11 +38,8 @@ houseprice = 631000
 
 
 def get_ltv_tranch(amount, houseprice):
-    ltv_boundaries = (0.675, 0.9, 1.0)
-    ltv_tranch_names = ('<67.5%', '67.5% - 90%', '90% - 100%', '>100%')
-    ltv = amount / houseprice
-    ltv_index = bisect(ltv_boundaries, ltv)
-    return ltv_index, ltv_tranch_names[ltv_index]
+    ltv_index = int(get_ltv_band(amount / houseprice))
+    return ltv_index, LTV_BAND_NAMES[ltv_index]
 
 PERIODS = 30  # noqa
 
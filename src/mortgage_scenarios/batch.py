@@ -0,0 +1,544 @@
+"""
+Vectorized payment engine for batches of loanparts
+
+The functions in this module compute the same payment schedules as a
+MortgageLoanRunner with LoanPartIterators, but for many loanparts at once. The
+recurrence is stepped over the periods while every step operates on the
+arrays of all loanparts, so the cost per period is a handful of numpy
+operations regardless of the number of loans.
+
+Input arguments broadcast against each other. The broadcast shape is the
+loan shape, for example (n_mortgages, n_loanparts), and the output arrays have
+shape loan shape + (n_periods,). Periods after a loanpart has finished are
+zero, as a MortgageLoanRunner no longer counts loanparts that are done.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .core import PaymentData
+from .utils import get_annuity_payment, get_balance_after, round_cents, to_cents, \
+    from_cents
+
+PAYMENT_COLUMNS = ['amount', 'payment', 'interest', 'repayment', 'amount_end']
+DEFAULT_CHUNK_BUDGET = 8 * 2 ** 20
+YEAR_COLUMNS = ['amount', 'payment', 'repayment', 'interest', 'amount_end']
+
+
+@dataclass
+class YearlyPayments:
+    """
+    dataclass to store payment data aggregated per calendar year
+
+    The columns follow group_by_year: the amount at the start of the first month,
+    the mean payment, repayment and interest per month and the amount after the
+    last month. Arrays have shape loan shape + (n_years,). months holds the
+    number of months in which payments are done in each year.
+    """
+
+    years: np.ndarray
+    amount: np.ndarray
+    payment: np.ndarray
+    repayment: np.ndarray
+    interest: np.ndarray
+    amount_end: np.ndarray
+    months: np.ndarray
+
+    def to_dataframe(self):
+        """
+        returns the yearly data of a single mortgage with the same layout as
+        group_by_year. Years without payments are dropped.
+        """
+        if self.amount.ndim != 1:
+            raise ValueError('yearly payments of a single mortgage expected, '
+                             'got array with shape {}'.format(self.amount.shape))
+        has_payments = self.months > 0
+        data = {column: getattr(self, column)[has_payments]
+                for column in YEAR_COLUMNS}
+        return pd.DataFrame(data, index=self.years[has_payments])
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, start_year_month=None, n_periods=None,
+                       months=None):
+        """
+        converts the output of group_by_year of a single mortgage
+
+        :param df: dataframe indexed by year with the columns of group_by_year
+        :param start_year_month: the start period passed to group_by_year
+        :param n_periods: the number of months in the dataframe passed to
+        group_by_year
+        :param months: the number of months with payments per year, instead of
+        start_year_month and n_periods
+
+        group_by_year does not keep the number of months of each year, so they
+        are derived from the start period and the number of months, as in
+        batch_group_by_year.
+        """
+        if months is None:
+            if start_year_month is None or n_periods is None:
+                raise ValueError('start_year_month and n_periods, or months, are '
+                                 'required to convert a group_by_year dataframe')
+            years, starts = _year_starts(start_year_month, n_periods)
+            if not np.array_equal(years, df.index):
+                raise ValueError('the years of the dataframe do not match '
+                                 'start_year_month and n_periods')
+            months = np.diff(np.append(starts, n_periods))
+        n_years = df.shape[0]
+        data = {column: df[column].to_numpy(dtype=float) for column in YEAR_COLUMNS}
+        return cls(years=np.asarray(df.index), months=np.broadcast_to(months, n_years),
+                   **data)
+
+
+def _broadcast_inputs(amount, rates, npers, fv, fixed, n_periods=None):
+    """
+    broadcasts the inputs of batch_schedule to a common loan shape
+
+    returns the broadcasted arrays plus the number of periods of the output
+    """
+    rates = np.asarray(rates, dtype=float)
+    if rates.ndim == 0:
+        raise ValueError('rates should have a trailing axis with the periods')
+
+    npers = np.asarray(npers)
+    if not np.issubdtype(npers.dtype, np.integer):
+        if not np.all(npers == np.round(npers)):
+            raise ValueError('npers should contain whole numbers of periods')
+        npers = npers.astype(np.int64)
+    if np.any(npers < 1):
+        raise ValueError('npers should be a positive number, '
+                         '"{}" provided'.format(npers.min()))
+
+    shape = np.broadcast(amount, npers, fv, fixed, rates[..., 0]).shape
+    if n_periods is None:
+        n_periods = int(npers.max())
+    if 1 < rates.shape[-1] < n_periods:
+        raise ValueError('rates should have 1 or at least {} periods, '
+                         '{} provided'.format(n_periods, rates.shape[-1]))
+
+    rates = np.broadcast_to(rates, shape + rates.shape[-1:])
+    npers = np.broadcast_to(npers, shape)
+    amount = np.broadcast_to(np.asarray(amount, dtype=float), shape)
+    fv = np.broadcast_to(np.asarray(fv, dtype=float), shape)
+    fixed = np.broadcast_to(np.asarray(fixed, dtype=float), shape)
+    return amount, rates, npers, fv, fixed, n_periods
+
+
+def _update_errors(max_errors, stored, balance, interest, repayment, active):
+    """
+    updates the maximum absolute errors of the stored values of a period
+
+    stored holds the stored amount, interest and repayment of the period, the
+    other arguments are the float64 values. The payment and amount_end columns
+    are derived from the stored values, as the properties of PaymentData do.
+    """
+    amount, interest_stored, repayment_stored = stored
+    exact_amount = np.where(active, balance, 0.)
+    exact_interest = np.where(active, interest, 0.)
+    exact_repayment = np.where(active, repayment, 0.)
+    pairs = {'amount': (amount, exact_amount),
+             'interest': (interest_stored, exact_interest),
+             'repayment': (repayment_stored, exact_repayment),
+             'payment': (interest_stored + repayment_stored,
+                         exact_interest + exact_repayment),
+             'amount_end': (amount - repayment_stored,
+                            exact_amount - exact_repayment)}
+    for column, (values, exact) in pairs.items():
+        error = np.abs(values.astype(float) - exact).max(initial=0.)
+        max_errors[column] = max(max_errors[column], float(error))
+
+
+def batch_schedule(amount, rates, npers, fv=0., fixed=0., cents=False,
+                   rounding='half_up', n_periods=None, storage_dtype=None,
+                   errors=None, rate_hook=None):
+    """
+    computes the payments of a batch of loanparts with rates that may change
+    every period
+
+    :param amount: the amount of each loan at the start
+    :param rates: the interest rate per period, with a trailing axis for the
+    periods. A trailing axis of length 1 means a constant rate.
+    :param npers: the number of periods of each loan
+    :param fv: the future value of each loan (after the payments are done)
+    :param fixed: a fixed amount paid each period, which is counted as interest
+    :param cents: if True, the schedule is computed in int64 cents with the
+    rounding convention of the lender, see below
+    :param rounding: rounding used in cents mode, 'half_up' or 'half_even'
+    :param n_periods: the number of periods to compute, by default the
+    largest number of periods in npers
+    :param storage_dtype: dtype of the output arrays, for example np.float32 to
+    halve the memory of large batches. The balances are computed in float64.
+    :param errors: optional dictionary that is filled with the maximum absolute
+    error of each column of the output against the float64 values
+    :param rate_hook: optional function called at the start of each period with
+    the period, the balances of the active loans (0 for finished loans, in
+    euros) and the rates of the period. It returns the rates to use in the
+    period, for example to price loans on their loan-to-value.
+    :return: PaymentData with arrays of shape loan shape + (n_periods,)
+
+    When the rate of a loan changes, the payment is recomputed with the
+    current amount and remaining periods, which is the same as replacing the
+    loanpart with LoanPartIterator.new_loanpart_with_rate.
+
+    In cents mode the amounts are converted to whole cents and all outputs are
+    int64 cents. Each time the payment is (re)computed it is rounded to cents,
+    the interest is the balance times the rate rounded to cents and the
+    repayment is the rounded payment minus the interest. In the last period the
+    repayment is the remaining balance minus fv, so the loan closes exactly.
+    """
+    amount, rates, npers, fv, fixed, n_periods = _broadcast_inputs(
+        amount, rates, npers, fv, fixed, n_periods)
+    shape = amount.shape
+    constant_rate = rates.shape[-1] == 1
+
+    if cents and storage_dtype is not None:
+        raise ValueError('storage_dtype is not supported in cents mode')
+    if cents:
+        dtype = np.int64
+        balance = to_cents(amount, rounding)
+        fv = to_cents(fv, rounding)
+        fixed = to_cents(fixed, rounding)
+    else:
+        dtype = float if storage_dtype is None else storage_dtype
+        balance = amount.copy()
+    track_errors = errors is not None
+    max_errors = dict.fromkeys(PAYMENT_COLUMNS, 0.)
+
+    # periods are stored on the first axis while stepping, so every period
+    # writes a contiguous block of memory
+    amount_out = np.zeros((n_periods,) + shape, dtype=dtype)
+    interest_out = np.zeros_like(amount_out)
+    repayment_out = np.zeros_like(amount_out)
+
+    payment = np.zeros(shape, dtype=dtype)
+    previous_rate = np.full(shape, np.nan)
+    for period in range(n_periods):
+        rate = rates[..., 0] if constant_rate else rates[..., period]
+        remaining = npers - period
+        active = remaining > 0
+        if rate_hook is not None:
+            balance_euros = from_cents(balance) if cents else balance
+            rate = np.broadcast_to(
+                rate_hook(period, np.where(active, balance_euros, 0), rate), shape)
+
+        if period == 0 or not constant_rate or rate_hook is not None:
+            changed = rate != previous_rate
+            if changed.any():
+                new_payment = get_annuity_payment(rate, np.maximum(remaining, 1),
+                                                  balance, fv)
+                if cents:
+                    new_payment = round_cents(new_payment, rounding)
+                payment = np.where(changed, new_payment + fixed, payment)
+            previous_rate = rate
+
+        if cents:
+            interest = round_cents(balance * rate, rounding) + fixed
+            repayment = np.where(remaining == 1, balance - fv, payment - interest)
+        else:
+            interest = balance * rate + fixed
+            repayment = payment - interest
+
+        balance_start = balance
+        if active.all():
+            amount_out[period] = balance
+            interest_out[period] = interest
+            repayment_out[period] = repayment
+            balance = balance - repayment
+        else:
+            amount_out[period] = np.where(active, balance, 0)
+            interest_out[period] = np.where(active, interest, 0)
+            repayment_out[period] = np.where(active, repayment, 0)
+            balance = np.where(active, balance - repayment, balance)
+
+        if track_errors:
+            stored = (amount_out[period], interest_out[period], repayment_out[period])
+            _update_errors(max_errors, stored, balance_start, interest, repayment,
+                           active)
+
+    if track_errors:
+        errors.update(max_errors)
+    return PaymentData(amount=np.moveaxis(amount_out, 0, -1),
+                       interest=np.moveaxis(interest_out, 0, -1),
+                       repayment=np.moveaxis(repayment_out, 0, -1))
+
+
+def batch_payments(amount, rate, npers, fv=0., fixed=0., cents=False,
+                   rounding='half_up', n_periods=None, granularity='month',
+                   start_year_month=None):
+    """
+    computes the payments of a batch of loanparts with a constant rate
+
+    This is the vectorized equivalent of running generate_payments for each
+    loanpart. See batch_schedule for the description of the arguments.
+
+    :param granularity: 'month' returns PaymentData per month, 'year' returns
+    YearlyPayments per calendar year, see batch_yearly_payments
+    :param start_year_month: the month of the first period, required for
+    granularity 'year'
+    """
+    if granularity == 'year':
+        if cents or n_periods is not None:
+            raise ValueError('cents and n_periods are not supported for '
+                             'granularity "year"')
+        if start_year_month is None:
+            raise ValueError('start_year_month is required for granularity "year"')
+        return batch_yearly_payments(amount, rate, npers, start_year_month, fv, fixed)
+    if granularity != 'month':
+        raise ValueError('granularity should be "month" or "year", '
+                         '"{}" provided'.format(granularity))
+
+    rates = np.asarray(rate, dtype=float)[..., None]
+    return batch_schedule(amount, rates, npers, fv, fixed, cents=cents,
+                          rounding=rounding, n_periods=n_periods)
+
+
+def sum_loanparts(payments, axis=-2):
+    """
+    sums the payments of loanparts into payments of mortgages
+
+    :param payments: PaymentData or YearlyPayments of the batch engine
+    :param axis: the axis with the loanparts, by default the one before the
+    periods or years axis
+    """
+    if isinstance(payments, YearlyPayments):
+        months = payments.months.max(axis=axis)
+        divisor = np.maximum(months, 1)
+        # loanparts that finish before the end of the year do not count in the
+        # amount after the last month of the mortgage
+        in_last_month = payments.months == np.expand_dims(months, axis)
+
+        def _mean(values):
+            return (values * payments.months).sum(axis=axis) / divisor
+
+        return YearlyPayments(years=payments.years,
+                              amount=payments.amount.sum(axis=axis),
+                              payment=_mean(payments.payment),
+                              repayment=_mean(payments.repayment),
+                              interest=_mean(payments.interest),
+                              amount_end=np.where(in_last_month, payments.amount_end,
+                                                  0.).sum(axis=axis),
+                              months=months)
+
+    return PaymentData(amount=payments.amount.sum(axis=axis),
+                       interest=payments.interest.sum(axis=axis),
+                       repayment=payments.repayment.sum(axis=axis))
+
+
+def batch_to_dataframe(payments: PaymentData):
+    """
+    converts the payments of a single mortgage or loanpart into a dataframe
+    with the same layout as MortgageLoanRunner.to_dataframe
+
+    periods after the last payment are dropped
+    """
+    if payments.amount.ndim != 1:
+        raise ValueError('payments of a single mortgage expected, '
+                         'got array with shape {}'.format(payments.amount.shape))
+
+    active = (payments.amount != 0) | (payments.interest != 0) | \
+             (payments.repayment != 0)
+    n_periods = np.flatnonzero(active)[-1] + 1 if active.any() else 0
+    data = {column: getattr(payments, column)[:n_periods]
+            for column in PAYMENT_COLUMNS}
+    df = pd.DataFrame(data, index=pd.RangeIndex(n_periods, name='period'))
+    return df
+
+
+def _year_starts(start_year_month, n_periods):
+    """
+    returns the years and the index of the first period in each year for a
+    schedule of n_periods months starting at start_year_month
+    """
+    start = pd.Period(start_year_month, freq='M')
+    month_offset = start.month - 1
+    n_years = (month_offset + n_periods - 1) // 12 + 1
+    years = start.year + np.arange(n_years)
+    starts = np.maximum(np.arange(n_years) * 12 - month_offset, 0)
+    return years, starts
+
+
+def batch_group_by_year(payments: PaymentData, start_year_month):
+    """
+    groups the payment data of the batch engine from months to calendar years
+
+    :param payments: output of the batch engine
+    :param start_year_month: string indicating the start period,
+    for example: '2020-01', '2021'
+    :return: YearlyPayments
+
+    This is the vectorized equivalent of group_by_year. Months after a loan
+    has finished are not counted in the means.
+    """
+    n_periods = payments.amount.shape[-1]
+    years, starts = _year_starts(start_year_month, n_periods)
+
+    active = (payments.amount != 0) | (payments.interest != 0) | \
+             (payments.repayment != 0)
+    months = np.add.reduceat(active, starts, axis=-1)
+    divisor = np.maximum(months, 1)
+
+    last = np.maximum(starts + months - 1, starts)
+    amount_end = np.take_along_axis(payments.amount_end, last, axis=-1)
+
+    def _mean(values):
+        return np.add.reduceat(values, starts, axis=-1) / divisor
+
+    return YearlyPayments(years=years,
+                          amount=payments.amount[..., starts],
+                          payment=_mean(payments.payment),
+                          repayment=_mean(payments.repayment),
+                          interest=_mean(payments.interest),
+                          amount_end=np.where(months > 0, amount_end, 0),
+                          months=months)
+
+
+def batch_yearly_payments(amount, rate, npers, start_year_month, fv=0., fixed=0.):
+    """
+    computes the yearly aggregates of a batch of loanparts in closed form
+
+    :param amount: the amount of each loan at the start
+    :param rate: the constant interest rate per period
+    :param npers: the number of periods of each loan
+    :param start_year_month: the month of the first period, for example '2020-10'
+    :param fv: the future value of each loan
+    :param fixed: a fixed amount paid each period, which is counted as interest
+    :return: YearlyPayments
+
+    The result equals batch_group_by_year of the monthly payments, but the
+    months are never materialized. With a constant payment, the balance at the
+    start of each year follows from the annuity formula, the repayments in a
+    year are the difference of two balances and the interest is the rest of
+    the payments. The cost is proportional to the number of years.
+    """
+    amount, rates, npers, fv, fixed, n_periods = _broadcast_inputs(
+        amount, np.asarray(rate, dtype=float)[..., None], npers, fv, fixed)
+    rate = rates[..., 0]
+    years, starts = _year_starts(start_year_month, n_periods)
+    ends = np.append(starts[1:], n_periods)
+
+    npers = npers[..., None]
+    first = np.minimum(starts, npers)
+    last = np.minimum(ends, npers)
+    months = last - first
+
+    payment = get_annuity_payment(rate, npers[..., 0], amount, fv)[..., None]
+    rate = rate[..., None]
+    balance_start = get_balance_after(rate, first, amount[..., None], payment)
+    balance_end = get_balance_after(rate, last, amount[..., None], payment)
+
+    has_payments = months > 0
+    divisor = np.maximum(months, 1)
+    repayment = balance_start - balance_end
+    total_payment = (payment + fixed[..., None]) * months
+    return YearlyPayments(years=years,
+                          amount=np.where(has_payments, balance_start, 0.),
+                          payment=total_payment / divisor,
+                          repayment=repayment / divisor,
+                          interest=(total_payment - repayment) / divisor,
+                          amount_end=np.where(has_payments, balance_end, 0.),
+                          months=months)
+
+
+def get_chunk_size(n_periods, loans_per_row=1, memory_budget=DEFAULT_CHUNK_BUDGET):
+    """
+    returns the number of rows of a batch that fit in a memory budget
+
+    :param n_periods: the number of periods of the schedules
+    :param loans_per_row: the number of loanparts in a row of the first axis
+    :param memory_budget: bytes available for the working arrays of one chunk,
+    by default sized to stay within the last level cache of a typical core
+    """
+    # three output buffers for all periods plus about ten working arrays
+    bytes_per_row = 8 * loans_per_row * (3 * n_periods + 10)
+    return max(1, int(memory_budget // bytes_per_row))
+
+
+def batch_schedule_chunked(amount, rates, npers, fv=0., fixed=0., cents=False,
+                           rounding='half_up', chunk_size=None, max_workers=None,
+                           out=None, storage_dtype=None, errors=None):
+    """
+    computes the same payments as batch_schedule in chunks on a thread pool
+
+    :param chunk_size: the number of rows of the first loan axis per chunk, by
+    default from get_chunk_size
+    :param max_workers: the number of threads, by default the number of CPUs
+    :param out: optional PaymentData with preallocated arrays of shape loan
+    shape + (n_periods,) to write the result into, for example memory-mapped
+    arrays for batches that do not fit in memory
+    :return: PaymentData, the out argument if provided
+
+    See batch_schedule for the other arguments. Each chunk is computed with
+    working arrays that stay small enough for the CPU caches and is copied into
+    the output. Numpy releases the GIL in its array operations, so the chunks
+    run in parallel on threads without pickling the inputs or outputs.
+    """
+    amount, rates, npers, fv, fixed, n_periods = _broadcast_inputs(
+        amount, rates, npers, fv, fixed)
+    shape = amount.shape
+    if not shape:
+        raise ValueError('at least one loan axis is required for chunking')
+    if chunk_size is None:
+        chunk_size = get_chunk_size(n_periods, int(np.prod(shape[1:])))
+    if out is None:
+        dtype = np.int64 if cents else (storage_dtype or float)
+        out = PaymentData(amount=np.empty(shape + (n_periods,), dtype=dtype),
+                          interest=np.empty(shape + (n_periods,), dtype=dtype),
+                          repayment=np.empty(shape + (n_periods,), dtype=dtype))
+    elif out.amount.shape != shape + (n_periods,):
+        raise ValueError('out should have shape {}, got {}'.format(
+            shape + (n_periods,), out.amount.shape))
+
+    def _run_chunk(start):
+        rows = slice(start, start + chunk_size)
+        chunk_errors = {} if errors is not None else None
+        result = batch_schedule(amount[rows], rates[rows], npers[rows], fv[rows],
+                                fixed[rows], cents=cents, rounding=rounding,
+                                n_periods=n_periods, storage_dtype=storage_dtype,
+                                errors=chunk_errors)
+        out.amount[rows] = result.amount
+        out.interest[rows] = result.interest
+        out.repayment[rows] = result.repayment
+        return chunk_errors
+
+    with ThreadPoolExecutor(max_workers or os.cpu_count()) as pool:
+        chunk_errors = list(pool.map(_run_chunk, range(0, shape[0], chunk_size)))
+    if errors is not None:
+        errors.update({column: max(e[column] for e in chunk_errors)
+                       for column in PAYMENT_COLUMNS})
+    return out
+
+
+def tune_chunk_size(amount, rates, npers, fv=0., fixed=0., candidates=None,
+                    max_workers=None, sample_rows=20000, repeats=2):
+    """
+    returns the fastest chunk size for batch_schedule_chunked on this machine
+
+    :param candidates: chunk sizes to try, by default powers of two around the
+    result of get_chunk_size
+    :param sample_rows: the number of rows of the batch used for timing
+    :param repeats: the number of timings per candidate, the best one counts
+
+    The other arguments are the inputs of batch_schedule_chunked. The timing
+    runs on the first sample_rows rows of the batch only.
+    """
+    amount, rates, npers, fv, fixed, n_periods = _broadcast_inputs(
+        amount, rates, npers, fv, fixed)
+    rows = slice(0, sample_rows)
+    sample = (amount[rows], rates[rows], npers[rows], fv[rows], fixed[rows])
+    if candidates is None:
+        default = get_chunk_size(n_periods, int(np.prod(amount.shape[1:])))
+        candidates = sorted({max(1, int(default * 2. ** i)) for i in range(-3, 3)})
+
+    timings = {}
+    for chunk_size in candidates:
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            batch_schedule_chunked(*sample, chunk_size=chunk_size,
+                                   max_workers=max_workers)
+            best = min(best, time.perf_counter() - start)
+        timings[chunk_size] = best
+    return min(timings, key=timings.get)
@@ -0,0 +1,196 @@
+"""
+Discounted comparison of alternative mortgage strategies
+
+A strategy is a rate path for the loanparts of a mortgage, for example
+"refix now at rate X" or "keep the current rate and refix at Y when the fixed
+period ends", plus a refix penalty (boeterente) paid at a given period. All
+strategies are computed in one call to the batch engine and evaluated on a
+shared set of discount curves.
+
+Shapes: strategy arrays have a leading strategy axis followed by the loan
+shape, discount curves have shape (n_curves, n_periods). Results have shape
+(n_strategies, n_curves) + loan shape, with a trailing period axis for the
+cumulative differences.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .batch import batch_schedule
+
+
+def refix_rates(current_rate, new_rate, refix_period, n_periods):
+    """
+    returns the rate per period for a loan that changes rate at refix_period
+
+    :param current_rate: the rate before the refix
+    :param new_rate: the rate from refix_period onwards
+    :param refix_period: the first period with the new rate, 0 refixes now
+    :param n_periods: the number of periods
+    :return: array with shape broadcast shape of the inputs + (n_periods,)
+    """
+    periods = np.arange(n_periods)
+    refix_period = np.asarray(refix_period)[..., None]
+    return np.where(periods < refix_period, np.asarray(current_rate)[..., None],
+                    np.asarray(new_rate)[..., None])
+
+
+def refix_penalty(amount, contract_rate, market_rate, remaining_fixed_periods,
+                  penalty_free_fraction=0.1):
+    """
+    computes the refix penalty (boeterente) for ending a fixed-rate period early
+
+    :param amount: the current amount of the loanpart
+    :param contract_rate: the rate per period of the current contract
+    :param market_rate: the rate per period for the remaining fixed period
+    :param remaining_fixed_periods: the periods left in the fixed-rate period
+    :param penalty_free_fraction: the fraction of the amount that can be repaid
+    without penalty
+    :return: the penalty, zero if the market rate is not lower than the contract
+
+    The penalty is the present value of the interest difference on the amount
+    above the penalty-free part over the remaining fixed periods, discounted at
+    the market rate. This is the interest-only approximation most lenders use.
+    """
+    market_rate = np.asarray(market_rate, dtype=float)
+    rate_difference = np.maximum(np.asarray(contract_rate) - market_rate, 0.)
+    periods = np.asarray(remaining_fixed_periods)
+    masked_rate = np.where(market_rate == 0, 1., market_rate)
+    annuity_factor = np.where(market_rate == 0, periods,
+                              (1 - np.power(1 + masked_rate, -periods)) / masked_rate)
+    penalised_amount = np.asarray(amount) * (1 - penalty_free_fraction)
+    return rate_difference * penalised_amount * np.maximum(annuity_factor, 0.)
+
+
+def discount_factors(rates, n_periods):
+    """
+    returns the discount factor of a payment at the end of each period
+
+    :param rates: discount rates per period with shape (n_curves, 1) for flat
+    curves or (n_curves, n_periods) for forward rates per period
+    :param n_periods: the number of periods
+    """
+    rates = np.atleast_2d(np.asarray(rates, dtype=float))
+    rates = np.broadcast_to(rates, (rates.shape[0], n_periods))
+    return np.cumprod(1 / (1 + rates), axis=-1)
+
+
+@dataclass
+class StrategyComparison:
+    """
+    dataclass with the result of compare_strategies
+
+    npv: the present value of all payments and penalties per strategy
+    cumulative_difference: the cumulative discounted cost compared to the
+    baseline strategy per period
+    break_even: the first period from which the cumulative difference stays at
+    or below zero, -1 if the strategy does not break even
+    """
+
+    names: list
+    baseline: int
+    npv: np.ndarray
+    cumulative_difference: np.ndarray
+    break_even: np.ndarray
+
+    def to_dataframe(self):
+        """returns npv and break even of a single mortgage per strategy and curve"""
+        if self.npv.ndim != 2:
+            raise ValueError('comparison of a single mortgage expected, '
+                             'got npv with shape {}'.format(self.npv.shape))
+        n_strategies, n_curves = self.npv.shape
+        index = pd.MultiIndex.from_product([self.names, range(n_curves)],
+                                           names=['strategy', 'curve'])
+        return pd.DataFrame({'npv': self.npv.ravel(),
+                             'npv_difference': (self.npv - self.npv[self.baseline])
+                             .ravel(),
+                             'break_even': self.break_even.ravel()}, index=index)
+
+
+def _expand_strategy_axis(value, ndim):
+    """
+    inserts axes after the strategy axis, so that an array with values per
+    strategy broadcasts against arrays with ndim dimensions
+    """
+    value = np.asarray(value)
+    if 0 < value.ndim < ndim:
+        value = value.reshape(value.shape[:1] + (1,) * (ndim - value.ndim)
+                              + value.shape[1:])
+    return value
+
+
+def compare_strategies(amount, npers, strategy_rates, discount_rates, fv=0.,
+                       fixed=0., penalties=0., penalty_periods=0, names=None,
+                       baseline=0, loanpart_axis=None):
+    """
+    computes the NPV of mortgage strategies on a set of discount curves
+
+    :param amount: the current amount of the loanparts, broadcastable to the
+    loan shape
+    :param npers: the remaining periods of the loanparts
+    :param strategy_rates: rate per period for each strategy, with shape
+    (n_strategies,) + loan shape + (n_periods,) or a trailing axis of 1.
+    Axes for the loan shape are inserted if missing.
+    :param discount_rates: discount rate per period for each curve, see
+    discount_factors
+    :param fv: the future value of the loanparts
+    :param fixed: the fixed amount paid each period
+    :param penalties: the refix penalty of each strategy, with shape
+    (n_strategies,) + loan shape, see refix_penalty
+    :param penalty_periods: the period in which the penalty is paid
+    :param names: the names of the strategies
+    :param baseline: the index of the strategy the others are compared with
+    :param loanpart_axis: axis of the loan shape with the loanparts of a
+    mortgage. If given, the loanparts are summed before the comparison.
+    :return: StrategyComparison
+
+    All strategies, curves and mortgages are evaluated with array operations,
+    the payment schedules are computed in a single call to the batch engine.
+    """
+    loan_ndim = max(np.ndim(value) for value in (amount, npers, fv, fixed))
+    strategy_rates = _expand_strategy_axis(np.asarray(strategy_rates, dtype=float),
+                                           loan_ndim + 2)
+    n_strategies = strategy_rates.shape[0]
+    payments = batch_schedule(amount, strategy_rates, npers, fv, fixed)
+    n_periods = payments.amount.shape[-1]
+    loan_shape = payments.amount.shape[1:-1]
+
+    cash_flows = payments.payment.copy()
+    penalty_periods = np.broadcast_to(
+        _expand_strategy_axis(penalty_periods, loan_ndim + 1),
+        (n_strategies,) + loan_shape)
+    penalties = np.broadcast_to(
+        _expand_strategy_axis(np.asarray(penalties, dtype=float), loan_ndim + 1),
+        (n_strategies,) + loan_shape)
+    paid_in_period = np.take_along_axis(cash_flows, penalty_periods[..., None],
+                                        axis=-1)
+    np.put_along_axis(cash_flows, penalty_periods[..., None],
+                      paid_in_period + penalties[..., None], axis=-1)
+
+    if loanpart_axis is not None:
+        axis = loanpart_axis + 1 if loanpart_axis >= 0 else loanpart_axis - 1
+        cash_flows = cash_flows.sum(axis=axis)
+        loan_shape = cash_flows.shape[1:-1]
+
+    # discounted cash flows with shape (n_strategies, n_curves) + loan shape
+    # + (n_periods,)
+    factors = discount_factors(discount_rates, n_periods)
+    factors = factors.reshape(factors.shape[:1] + (1,) * len(loan_shape)
+                              + (n_periods,))
+    cumulative = np.cumsum(cash_flows[:, None] * factors, axis=-1)
+    npv = cumulative[..., -1]
+
+    cumulative_difference = cumulative - cumulative[baseline]
+    # a strategy breaks even from the first period after which the
+    # difference never rises above zero again
+    remaining_max = np.maximum.accumulate(cumulative_difference[..., ::-1],
+                                          axis=-1)[..., ::-1]
+    settled = remaining_max <= 0
+    break_even = np.where(settled.any(axis=-1), settled.argmax(axis=-1), -1)
+
+    if names is None:
+        names = ['strategy {}'.format(i) for i in range(n_strategies)]
+    return StrategyComparison(names=list(names), baseline=baseline, npv=npv,
+                              cumulative_difference=cumulative_difference,
+                              break_even=break_even)
@@ -1,11 +1,12 @@
 """Main module"""
-from copy import copy, deepcopy
-from dataclasses import dataclass
+from copy import copy
+from dataclasses import dataclass, replace
+from typing import Tuple
 
-import pandas as pd
 import numpy as np
+import pandas as pd
 
-from .utils import get_monthly_rate
+from .utils import get_monthly_rate, get_annuity_payment
 
 
 @dataclass
@@ -93,7 +94,7 @@ def generate_payments(amount_boy, rate, npers, fv=0., fixed=0.):
     :param float fv: the future value (after the payments are done)
     :param float fixed: a fixed payment amount done each period (default is 0)
 
-    This is a wrapper around the np.pmt function with some additional
+    This is a wrapper around the get_annuity_payment function with some additional
     information returns for each period:
     - interest paid
     - repayment done
@@ -102,9 +103,7 @@ def generate_payments(amount_boy, rate, npers, fv=0., fixed=0.):
     """
     if npers < 1:
         raise ValueError('npers should be a positive number, "{}" provided'.format(npers))
-    # TODO: pmt is depreciated, use replacement function
-    # noinspection PyTypeChecker
-    payment = -np.pmt(rate, npers, amount_boy, -fv, when='end') + fixed
+    payment = get_annuity_payment(rate, npers, amount_boy, fv) + fixed
     for i in range(npers):
 
         interest = amount_boy*rate + fixed
@@ -121,6 +120,28 @@ def generate_payments(amount_boy, rate, npers, fv=0., fixed=0.):
                       amount=amount_boy)
 
 
+@dataclass(frozen=True)
+class LoanPartState:
+    """
+    immutable snapshot of the status of a loanpart
+
+    A snapshot does not hold a payment generator, so it is cheap to create,
+    copy and share. Forks with a different rate are made with with_rate, and
+    LoanPartIterator.from_state continues the loanpart from the snapshot.
+    """
+
+    amount: float
+    rate: float
+    remaining_periods: int
+    future: float = 0.
+    fixed: float = 0.
+    period: int = 0
+
+    def with_rate(self, rate):
+        """returns a fork of the state with a new interest rate"""
+        return replace(self, rate=rate)
+
+
 class LoanPartIterator:
     """
     Generates payments of a loan and stores remaining amount and period internally
@@ -146,6 +167,8 @@ class LoanPartIterator:
         self.n_periods = periods
         self.rate = rate
         self._calculator = None
+        # periods run before the start of this iterator, see from_state
+        self._period_offset = 0
 
         self.reset()
 
@@ -189,11 +212,64 @@ class LoanPartIterator:
         """
         returns a new LoanPartIterator with the same status as the current loanpart
         (using the current amount and remaining periods), but with an
-        updated interest rate
+        updated interest rate. The period of its snapshots continues from the
+        period of the current loanpart.
+        """
+
+        loanpart = LoanPartIterator(self.current_amount, rate,
+                                    self.remaining_periods, self.future, self.fixed)
+        loanpart._period_offset = self._period_offset + self.current_period
+        return loanpart
+
+    def snapshot(self) -> LoanPartState:
+        """returns an immutable snapshot of the current status of the loanpart"""
+        return LoanPartState(amount=self.current_amount, rate=self.rate,
+                             remaining_periods=self.remaining_periods,
+                             future=self.future, fixed=self.fixed,
+                             period=self._period_offset + self.current_period)
+
+    @classmethod
+    def from_state(cls, state: LoanPartState):
+        """
+        returns a new LoanPartIterator that continues from a snapshot
+
+        the payment is recomputed from the amount and remaining periods of the
+        snapshot, in the same way as new_loanpart_with_rate. current_period
+        counts from the snapshot, while the period of new snapshots continues
+        from the period of the snapshot.
         """
+        loanpart = cls(state.amount, state.rate, state.remaining_periods,
+                       state.future, state.fixed)
+        loanpart._period_offset = state.period
+        return loanpart
 
-        return LoanPartIterator(self.current_amount, rate,
-                                self.remaining_periods, self.future, self.fixed)
+
+@dataclass(frozen=True)
+class MortgageState:
+    """
+    immutable snapshot of the status of all loanparts of a mortgage
+    """
+
+    loanparts: Tuple[LoanPartState, ...]
+    period: int = 0
+
+    def with_rates(self, rates):
+        """
+        returns a fork of the state with new interest rates
+
+        :param rates: a single rate for all loanparts or a sequence or array
+        with one rate per loanpart. None keeps the rate of a loanpart.
+        """
+        if np.ndim(rates) == 0:
+            rates = [rates] * len(self.loanparts)
+        elif np.ndim(rates) != 1:
+            raise ValueError('rates should be a single rate or one rate per loanpart')
+        if len(rates) != len(self.loanparts):
+            raise ValueError('{} rates provided for {} loanparts'.format(
+                len(rates), len(self.loanparts)))
+        loanparts = tuple(loanpart if rate is None else loanpart.with_rate(rate)
+                          for loanpart, rate in zip(self.loanparts, rates))
+        return replace(self, loanparts=loanparts)
 
 
 class MortgageLoanRunner:
@@ -269,6 +345,26 @@ class MortgageLoanRunner:
         df = df[['amount', 'payment', 'interest', 'repayment', 'amount_end']]
         return df
 
+    def snapshot(self) -> MortgageState:
+        """returns an immutable snapshot of the status of all loanparts"""
+        return MortgageState(
+            loanparts=tuple(loanpart.snapshot() for loanpart in self.loanparts),
+            period=self.period)
+
+    @classmethod
+    def from_state(cls, state: MortgageState):
+        """
+        returns a new MortgageLoanRunner that continues from a snapshot
+
+        the data of the periods before the snapshot is not part of the new
+        runner, its periods continue from the period of the snapshot
+        """
+        runner = cls()
+        for loanpart_state in state.loanparts:
+            runner.add_loanpart(LoanPartIterator.from_state(loanpart_state))
+        runner.period = state.period
+        return runner
+
     def replace_loanpart_by_index(self, loanpart, index=None):
         """
         replaces one of the existing loanparts with a new one
@@ -343,10 +439,11 @@ class MortgageScenarioRunner:
 
     def __init__(self, mortgage):
 
-        # make a copy of the mortgage and loans, to avoid side effects
-        self._mortgage = copy(mortgage)
-        self._mortgage_loans = deepcopy(mortgage.loanparts)
         if not len(mortgage.data) == 0:
             raise ValueError('mortgage input should not have started running')
 
+        # store a snapshot of the mortgage, to avoid side effects
+        self._mortgage = copy(mortgage)
+        self._mortgage_state = mortgage.snapshot()
+
         self._scenarios = {}
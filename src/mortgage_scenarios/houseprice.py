@@ -0,0 +1,192 @@
+"""
+House price paths and loan-to-value dependent pricing
+
+Lenders price a mortgage on its loan-to-value (LTV): the rate has a spread per
+LTV band, and the mortgage moves to a cheaper band when repayments or a rising
+house price bring its LTV below a band boundary. This module generates house
+price paths, deterministic growth curves or simulated paths that are
+correlated with simulated rate paths, computes the LTV of all mortgages and
+paths as one array operation and feeds the LTV bands back into the payment
+schedule of the batch engine.
+
+Shapes: house values have a trailing period axis and broadcast against the
+mortgage shape, which is the loan shape with the loanpart axis kept as an
+axis of length 1. For example amounts of shape (n_mortgages, 1, n_parts) and
+house values of shape (n_mortgages, n_paths, 1, n_periods) price every
+mortgage on every house price path.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from .batch import batch_schedule
+from .utils import get_monthly_rate
+
+LTV_BOUNDARIES = (0.675, 0.9, 1.0)
+LTV_BAND_NAMES = ('<67.5%', '67.5% - 90%', '90% - 100%', '>100%')
+
+
+def growth_path(house_value, n_periods, yearly_growth=0.):
+    """
+    house values at the start of each period with a deterministic growth
+
+    :param house_value: the current house value
+    :param n_periods: the number of monthly periods
+    :param yearly_growth: the yearly growth rate, constant or per period with
+    a trailing period axis
+    :return: array of shape house_value shape + (n_periods,)
+    """
+    yearly_growth = np.asarray(yearly_growth, dtype=float)
+    if yearly_growth.ndim == 0:
+        yearly_growth = np.full(n_periods, yearly_growth)
+    monthly_growth = get_monthly_rate(yearly_growth[..., :n_periods])
+    # the value of period 0 is the current value, growth applies afterwards
+    factors = np.cumprod(np.concatenate([np.ones(monthly_growth.shape[:-1] + (1,)),
+                                         1 + monthly_growth[..., :-1]], axis=-1),
+                         axis=-1)
+    return np.asarray(house_value, dtype=float)[..., None] * factors
+
+
+@dataclass
+class MarketPaths:
+    """
+    dataclass with simulated house price and rate paths
+
+    price_index: the house price relative to period 0, (n_paths, n_periods)
+    rates: the yearly rate of each period, (n_paths, n_periods)
+
+    Use house_values and path_rates with the same loanparts argument to get
+    arrays with aligned path axes for ltv_priced_schedule.
+    """
+
+    price_index: np.ndarray
+    rates: np.ndarray
+
+    def house_values(self, house_value, loanparts=False):
+        """
+        house values on all paths
+
+        :param house_value: the current house value of each mortgage
+        :param loanparts: if True, an axis of length 1 is added for the
+        loanparts of the mortgages
+        :return: array of shape house_value shape + (n_paths, n_periods), or
+        house_value shape + (n_paths, 1, n_periods) with loanparts
+        """
+        values = np.asarray(house_value, dtype=float)[..., None, None] * self.price_index
+        return values[..., None, :] if loanparts else values
+
+    def path_rates(self, loanparts=False):
+        """
+        the yearly rates of all paths, aligned with the paths of house_values
+
+        :param loanparts: if True, an axis of length 1 is added for the
+        loanparts of the mortgages
+        :return: array of shape (n_paths, n_periods), or (n_paths, 1, n_periods)
+        with loanparts
+        """
+        return self.rates[:, None, :] if loanparts else self.rates
+
+
+def simulate_market_paths(n_paths, n_periods, yearly_rate, price_drift=0.,
+                          price_volatility=0.05, rate_volatility=0.005,
+                          correlation=0., seed=None):
+    """
+    simulates joint monthly paths of house prices and rates
+
+    :param n_paths: the number of paths
+    :param n_periods: the number of monthly periods
+    :param yearly_rate: the yearly rate at the start
+    :param price_drift: the expected yearly growth of house prices
+    :param price_volatility: the yearly volatility of the house price returns
+    :param rate_volatility: the yearly volatility of the rate changes
+    :param correlation: the correlation between the rate changes and the house
+    price returns, typically negative
+    :param seed: the seed of the random generator
+    :return: MarketPaths
+
+    House prices follow a geometric Brownian motion and the rate an arithmetic
+    Brownian motion, both driven by correlated normal shocks each month.
+    """
+    rng = np.random.default_rng(seed)
+    dt = 1 / 12
+    rate_shocks = rng.standard_normal((n_paths, n_periods - 1))
+    price_shocks = correlation * rate_shocks \
+        + np.sqrt(1 - correlation ** 2) * rng.standard_normal((n_paths, n_periods - 1))
+
+    log_returns = (price_drift - 0.5 * price_volatility ** 2) * dt \
+        + price_volatility * np.sqrt(dt) * price_shocks
+    zeros = np.zeros((n_paths, 1))
+    price_index = np.exp(np.concatenate([zeros, np.cumsum(log_returns, axis=1)], axis=1))
+    rates = yearly_rate + np.concatenate(
+        [zeros, np.cumsum(rate_volatility * np.sqrt(dt) * rate_shocks, axis=1)], axis=1)
+    return MarketPaths(price_index=price_index, rates=rates)
+
+
+def get_ltv(amount, house_value):
+    """the loan-to-value of mortgage balances, elementwise"""
+    return np.asarray(amount) / np.asarray(house_value)
+
+
+def get_ltv_band(ltv, boundaries=LTV_BOUNDARIES):
+    """
+    the index of the LTV band of each LTV
+
+    an LTV equal to a boundary belongs to the higher band, as with
+    bisect.bisect in the experimental script
+    """
+    return np.searchsorted(boundaries, ltv, side='right')
+
+
+def ltv_priced_schedule(amount, yearly_rates, npers, house_value, band_spreads,
+                        fv=0., fixed=0., boundaries=LTV_BOUNDARIES, loanpart_axis=-1):
+    """
+    computes payments with rates that depend on the LTV band of the mortgage
+
+    :param amount: the amount of each loanpart at the start
+    :param yearly_rates: the yearly base rates, with a trailing period axis
+    like the rates of batch_schedule. Rates of simulated paths should have
+    the path axis of the house values, see MarketPaths.path_rates
+    :param npers: the number of periods of each loanpart
+    :param house_value: house values per period, with a trailing period axis
+    and broadcastable against the mortgage shape, see the module docstring
+    :param band_spreads: the yearly spread added to the base rate in each LTV
+    band, with a trailing axis of len(boundaries) + 1 bands
+    :param fv: the future value of each loanpart
+    :param fixed: a fixed amount paid each period
+    :param boundaries: the LTV boundaries of the bands
+    :param loanpart_axis: the axis of the loanparts of a mortgage, None if
+    every loan is a mortgage of its own
+    :return: PaymentData with arrays of shape loan shape + (n_periods,)
+
+    At the start of each period the LTV is the total balance of the mortgage
+    divided by the house value. When the LTV band of a mortgage changes, the
+    payments of its loanparts are recomputed with the new rate, like
+    replacing them with LoanPartIterator.new_loanpart_with_rate.
+    """
+    yearly_rates = np.asarray(yearly_rates, dtype=float)
+    house_value = np.asarray(house_value, dtype=float)
+    band_spreads = np.asarray(band_spreads, dtype=float)
+    if band_spreads.shape[-1] != len(boundaries) + 1:
+        raise ValueError('band_spreads should have {} bands, got {}'.format(
+            len(boundaries) + 1, band_spreads.shape[-1]))
+    n_periods = int(np.max(npers))
+
+    def _rate_hook(period, balance, rate):
+        total = balance if loanpart_axis is None \
+            else balance.sum(axis=loanpart_axis, keepdims=True)
+        ltv = get_ltv(total, house_value[..., min(period, house_value.shape[-1] - 1)])
+        band = get_ltv_band(ltv, boundaries)
+        shape = np.broadcast_shapes(band.shape, band_spreads.shape[:-1])
+        spread = np.take_along_axis(
+            np.broadcast_to(band_spreads, shape + band_spreads.shape[-1:]),
+            np.broadcast_to(band, shape)[..., None], axis=-1)[..., 0]
+        base = yearly_rates[..., min(period, yearly_rates.shape[-1] - 1)]
+        return get_monthly_rate(base + spread)
+
+    # the rates follow from the hook, the rates argument only sets the loan
+    # shape, which includes the paths of the house values
+    shape = np.broadcast_shapes(np.shape(amount), np.shape(npers),
+                                yearly_rates.shape[:-1], house_value.shape[:-1],
+                                band_spreads.shape[:-1])
+    return batch_schedule(amount, np.zeros(shape + (1,)), npers, fv, fixed,
+                          n_periods=n_periods, rate_hook=_rate_hook)
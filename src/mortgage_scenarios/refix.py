@@ -0,0 +1,259 @@
+"""
+Optimal refix timing under simulated rate paths
+
+During its fixed-rate period a loanpart can be refixed early at the market rate
+for a new fixed term, paying a refix penalty (boeterente), or it waits until
+the fixed-rate period ends and refixes without penalty. This module finds the
+best moment and term with least-squares Monte-Carlo: the expected cost of each
+choice is estimated by regressing the discounted path costs on the market rates
+at the decision moment, and the decisions are made by backward induction.
+
+Costs of a choice are evaluated in closed form per fixed-rate block: within a
+block the payment is constant, so the discounted payments are the payment
+times a sum of discount factors and the balance at the end of the block
+follows from the annuity formula. No monthly schedules are materialized.
+
+Shapes: loanpart inputs have shape (n_loans,), market rates have shape
+(n_paths, n_periods, n_terms) and hold the rate per period for fixing each
+term at the start of each period.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from .comparison import refix_penalty
+from .utils import get_annuity_payment, get_balance_after
+
+
+def _interpolate_terms(rates, term_periods, periods):
+    """
+    interpolates the market rates of the terms linearly to a number of periods
+
+    rates has a trailing axis with the terms, periods broadcasts against the
+    other axes
+    """
+    if len(term_periods) == 1:
+        return rates[..., 0]
+    upper = np.clip(np.searchsorted(term_periods, periods), 1, len(term_periods) - 1)
+    lower_periods, upper_periods = term_periods[upper - 1], term_periods[upper]
+    weight = np.clip((periods - lower_periods) / (upper_periods - lower_periods), 0, 1)
+    upper = np.broadcast_to(upper, rates.shape[:-1])[..., None]
+    weight = np.broadcast_to(weight, rates.shape[:-1])
+    rate_lower = np.take_along_axis(rates, upper - 1, axis=-1)[..., 0]
+    rate_upper = np.take_along_axis(rates, upper, axis=-1)[..., 0]
+    return rate_lower * (1 - weight) + rate_upper * weight
+
+
+def _basis(rates, degree):
+    """
+    regression basis of the market rates with shape (n_loans, n_paths, n_terms)
+
+    the rates are centered and scaled per loan to keep the regression well
+    conditioned. Returns the basis and the center and scale used.
+    """
+    center = rates.mean(axis=1, keepdims=True)
+    scale = rates.std(axis=1, keepdims=True)
+    scale = np.where(scale > 0, scale, 1.)
+    return _basis_from_scaled((rates - center) / scale, degree), center, scale
+
+
+def _basis_from_scaled(z, degree):
+    """polynomial basis without cross terms of the scaled rates"""
+    powers = [np.ones(z.shape[:-1] + (1,))] + [z ** d for d in range(1, degree + 1)]
+    return np.concatenate(powers, axis=-1)
+
+
+@dataclass
+class RefixPolicy:
+    """
+    dataclass with the result of optimize_refix
+
+    decision_periods: the decision moment of each loan for each step of the
+    decision grid, shape (n_loans, n_decisions)
+    refix_period, term_index: the chosen refix moment and term on each
+    simulated path, shape (n_loans, n_paths)
+    expected_cost: the expected discounted cost of the optimal policy
+    expected_cost_at_expiry: the expected cost when waiting until the end of
+    the fixed-rate period
+    coefficients, center, scale: regression of the expected costs on the
+    market rates for each decision, used by decide
+    """
+
+    term_periods: np.ndarray
+    decision_periods: np.ndarray
+    refix_period: np.ndarray
+    term_index: np.ndarray
+    expected_cost: np.ndarray
+    expected_cost_at_expiry: np.ndarray
+    coefficients: np.ndarray
+    center: np.ndarray
+    scale: np.ndarray
+    forced: np.ndarray
+    degree: int
+
+    @property
+    def refix_probability(self):
+        """fraction of the paths that refix at each decision, (n_loans, n_decisions)"""
+        n_decisions = self.decision_periods.shape[1]
+        decision = np.argmax(self.refix_period[..., None]
+                             == self.decision_periods[:, None, :], axis=-1)
+        return np.stack([(decision == j).mean(axis=-1) for j in range(n_decisions)],
+                        axis=-1)
+
+    def decide(self, decision, market_rates):
+        """
+        applies the policy to new market rates at a decision step
+
+        :param decision: index in the decision grid
+        :param market_rates: rates of the terms at the decision moment, with
+        shape (n_paths, n_terms)
+        :return: boolean array whether to refix and the term index to refix in,
+        both with shape (n_loans, n_paths)
+        """
+        z = (np.asarray(market_rates)[None] - self.center[:, decision]) \
+            / self.scale[:, decision]
+        estimates = _basis_from_scaled(z, self.degree) @ self.coefficients[:, decision]
+        term_index = np.argmin(estimates[..., 1:], axis=-1)
+        best = np.min(estimates[..., 1:], axis=-1)
+        refix = self.forced[:, decision, None] | (best < estimates[..., 0])
+        return refix, term_index
+
+
+def optimize_refix(amount, npers, contract_rate, fixed_periods, market_rates,
+                   term_periods, discount_rates=0., decision_step=12, fv=0.,
+                   fixed=0., penalty_free_fraction=0.1, degree=2):
+    """
+    finds the optimal refix moment and fixed term of loanparts
+
+    :param amount: the current amount of the loanparts
+    :param npers: the remaining periods of the loanparts
+    :param contract_rate: the current rate per period
+    :param fixed_periods: the remaining periods of the fixed-rate period
+    :param market_rates: simulated rates per period for fixing each term,
+    shape (n_paths, n_periods, n_terms)
+    :param term_periods: the number of periods of each term, in increasing order
+    :param discount_rates: discount rates per period, broadcastable to
+    (n_paths, n_periods)
+    :param decision_step: the number of periods between decisions
+    :param fv: the future value of the loanparts
+    :param fixed: the fixed amount paid each period
+    :param penalty_free_fraction: see refix_penalty
+    :param degree: the degree of the polynomial regression basis
+    :return: RefixPolicy
+
+    After a refix, the loanpart rolls over into the market rate of the same
+    term each time the new fixed term ends. Memory use scales with
+    n_loans * n_decisions * n_paths * n_terms, so large books are best
+    optimized in chunks of loans.
+    """
+    market_rates = np.asarray(market_rates, dtype=float)
+    n_paths, n_periods, n_terms = market_rates.shape
+    term_periods = np.asarray(term_periods)
+    amount, npers, contract_rate, fixed_periods, fv, fixed = (
+        np.atleast_1d(np.asarray(x, dtype=float)) for x in np.broadcast_arrays(
+            amount, npers, contract_rate, fixed_periods, fv, fixed))
+    npers = npers.astype(int)
+    fixed_periods = np.minimum(fixed_periods.astype(int), npers)
+    if npers.max() > n_periods:
+        raise ValueError('market rates should cover {} periods, {} provided'
+                         .format(npers.max(), n_periods))
+
+    discount = np.broadcast_to(np.asarray(discount_rates, dtype=float),
+                               (n_paths, n_periods))
+    # discount factor at the start of each period and cumulative discount
+    # factors of payments at the end of periods [0, s)
+    start_factors = np.concatenate([np.ones((n_paths, 1)),
+                                    np.cumprod(1 / (1 + discount), axis=1)], axis=1)
+    cumulative = np.concatenate([np.zeros((n_paths, 1)),
+                                 np.cumsum(start_factors[:, 1:], axis=1)], axis=1)
+
+    n_decisions = int(np.ceil(fixed_periods.max() / decision_step)) + 1
+    grid = np.arange(n_decisions) * decision_step
+    decision_periods = np.minimum(grid[None, :], fixed_periods[:, None])
+    forced = grid[None, :] >= fixed_periods[:, None]
+
+    # axes used below: (n_loans, n_decisions, n_paths, n_terms)
+    paths = np.arange(n_paths)[None, None, :, None]
+    loan = (slice(None), None, None, None)
+    d = decision_periods[:, :, None, None]
+
+    # costs before the decision, with the contract rate
+    contract_payment = get_annuity_payment(contract_rate, npers, amount, fv)
+    balance = get_balance_after(contract_rate[loan], d, amount[loan],
+                                contract_payment[loan])
+    pre_cost = (contract_payment + fixed)[loan] * (cumulative[paths, d]
+                                                   - cumulative[paths, 0])
+
+    # refix penalty at the decision, against the market rate of the remaining
+    # fixed-rate period
+    remaining_fixed = fixed_periods[loan] - d
+    rates_now = market_rates[paths, np.minimum(d, n_periods - 1)][..., 0, :]
+    penalty_rate = _interpolate_terms(rates_now, term_periods, remaining_fixed[..., 0])
+    penalty = refix_penalty(balance[..., 0], contract_rate[loan][..., 0],
+                            penalty_rate, remaining_fixed[..., 0],
+                            penalty_free_fraction)
+    penalty = np.where(remaining_fixed[..., 0] > 0, penalty, 0.)
+    cost = pre_cost + (penalty * start_factors[paths[..., 0], d[..., 0]])[..., None]
+
+    # costs after the decision, one fixed-rate block of each term at a time
+    shape = (len(amount), n_decisions, n_paths, n_terms)
+    cost = np.broadcast_to(cost, shape)
+    balance = np.broadcast_to(balance, shape)
+    start = np.broadcast_to(d, shape)
+    n_blocks = int(np.ceil(npers.max() / term_periods.min()))
+    for _ in range(n_blocks):
+        remaining = npers[loan] - start
+        if not np.any(remaining > 0):
+            break
+        block_start = np.minimum(start, n_periods - 1)
+        rate = market_rates[paths, block_start, np.arange(n_terms)]
+        length = np.clip(np.minimum(term_periods, remaining), 0, None)
+        payment = get_annuity_payment(rate, np.maximum(remaining, 1), balance, fv[loan])
+        end = start + length
+        cost = cost + np.where(length > 0, (payment + fixed[loan])
+                               * (cumulative[paths, end] - cumulative[paths, start]), 0.)
+        balance = np.where(length > 0,
+                           get_balance_after(rate, length, balance, payment), balance)
+        start = end
+
+    # backward induction with regression estimates of the expected costs
+    n_loans = len(amount)
+    rates_at_decision = market_rates[np.arange(n_paths)[None, None, :],
+                                     np.minimum(decision_periods, n_periods - 1)
+                                     [:, :, None]]
+    n_basis = 1 + degree * n_terms
+    coefficients = np.zeros((n_loans, n_decisions, n_basis, n_terms + 1))
+    centers = np.zeros((n_loans, n_decisions, 1, n_terms))
+    scales = np.ones((n_loans, n_decisions, 1, n_terms))
+
+    path_cost = None
+    refix_period = np.zeros((n_loans, n_paths), dtype=int)
+    term_index = np.zeros((n_loans, n_paths), dtype=int)
+    for j in reversed(range(n_decisions)):
+        basis, centers[:, j], scales[:, j] = _basis(rates_at_decision[:, j], degree)
+        exercise_cost = cost[:, j]
+        continuation = exercise_cost[..., :1] if path_cost is None \
+            else path_cost[..., None]
+        targets = np.concatenate([continuation, exercise_cost], axis=-1)
+        coefficients[:, j] = np.linalg.pinv(basis) @ targets
+        estimates = basis @ coefficients[:, j]
+
+        best_term = np.argmin(estimates[..., 1:], axis=-1)
+        best_cost = np.take_along_axis(exercise_cost, best_term[..., None],
+                                       axis=-1)[..., 0]
+        if path_cost is None:
+            exercise = np.ones((n_loans, n_paths), dtype=bool)
+            cost_at_expiry = best_cost
+        else:
+            best_estimate = np.min(estimates[..., 1:], axis=-1)
+            exercise = forced[:, j, None] | (best_estimate < estimates[..., 0])
+        path_cost = np.where(exercise, best_cost, path_cost)
+        refix_period = np.where(exercise, decision_periods[:, j, None], refix_period)
+        term_index = np.where(exercise, best_term, term_index)
+
+    return RefixPolicy(term_periods=term_periods, decision_periods=decision_periods,
+                       refix_period=refix_period, term_index=term_index,
+                       expected_cost=path_cost.mean(axis=-1),
+                       expected_cost_at_expiry=cost_at_expiry.mean(axis=-1),
+                       coefficients=coefficients, center=centers, scale=scales,
+                       forced=forced, degree=degree)
@@ -0,0 +1,144 @@
+"""
+Scenario trees with shared histories
+
+A what-if analysis often shares a long common history between scenarios, for
+example the same first 10 years followed by five different rates at the
+moment the fixed-rate period ends. A ScenarioNode describes one segment of
+such a history, and run_scenario_tree computes every segment once, starting
+from the MortgageState at the end of its parent segment.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .batch import PAYMENT_COLUMNS, batch_payments
+from .core import LoanPartState, MortgageState, PaymentData
+
+
+class ScenarioNode:
+    """
+    a segment of periods in a scenario tree
+
+    :param name: the name of the node, scenario names are the names of the
+    nodes from the root to the leaf joined by '/'
+    :param periods: the number of periods in the segment, at least 1. None runs
+    until all loanparts are repaid.
+    :param rates: rates set at the start of the segment, either one rate for
+    all loanparts or one per loanpart (see MortgageState.with_rates).
+    None keeps the current rates.
+    """
+
+    def __init__(self, name, periods=None, rates=None):
+        if periods is not None and periods < 1:
+            raise ValueError('periods of a segment should be at least 1, '
+                             'got {}'.format(periods))
+        self.name = name
+        self.periods = periods
+        self.rates = rates
+        self.children: List['ScenarioNode'] = []
+
+    def add_child(self, name, periods=None, rates=None) -> 'ScenarioNode':
+        """adds a segment that follows this segment and returns it"""
+        child = ScenarioNode(name, periods, rates)
+        self.children.append(child)
+        return child
+
+    def __repr__(self):
+        return 'ScenarioNode({!r}, periods={}, rates={}, children={})'.format(
+            self.name, self.periods, self.rates, len(self.children))
+
+
+def run_segment(state: MortgageState, periods: Optional[int] = None):
+    """
+    runs the loanparts of a mortgage state for a number of periods
+
+    :param state: the state at the start of the segment
+    :param periods: the number of periods, by default until all loanparts
+    are repaid
+    :return: the total payments of the mortgage per period and the state at
+    the end of the segment
+
+    loanparts that are repaid during the segment keep their final amount and
+    have zero remaining periods in the end state. A segment without periods
+    returns the state unchanged.
+    """
+    active = [lp for lp in state.loanparts if lp.remaining_periods > 0]
+    if not active or (periods is not None and periods < 1):
+        return PaymentData(amount=np.zeros(0), interest=np.zeros(0),
+                           repayment=np.zeros(0)), state
+
+    remaining = np.array([lp.remaining_periods for lp in active])
+    n_periods = int(remaining.max()) if periods is None \
+        else min(periods, int(remaining.max()))
+    payments = batch_payments(amount=[lp.amount for lp in active],
+                              rate=[lp.rate for lp in active],
+                              npers=remaining,
+                              fv=[lp.future for lp in active],
+                              fixed=[lp.fixed for lp in active],
+                              n_periods=n_periods)
+
+    steps = np.minimum(remaining, n_periods)
+    amount_end = payments.amount_end[np.arange(len(active)), steps - 1]
+    ends = iter(zip(amount_end, steps))
+    loanparts = []
+    for loanpart in state.loanparts:
+        if loanpart.remaining_periods <= 0:
+            loanparts.append(loanpart)
+            continue
+        amount, n_steps = next(ends)
+        loanparts.append(LoanPartState(
+            amount=float(amount), rate=loanpart.rate,
+            remaining_periods=loanpart.remaining_periods - int(n_steps),
+            future=loanpart.future, fixed=loanpart.fixed,
+            period=loanpart.period + int(n_steps)))
+
+    total = PaymentData(amount=payments.amount.sum(axis=0),
+                        interest=payments.interest.sum(axis=0),
+                        repayment=payments.repayment.sum(axis=0))
+    end_state = MortgageState(loanparts=tuple(loanparts),
+                              period=state.period + n_periods)
+    return total, end_state
+
+
+def run_scenario_tree(state: MortgageState, root: ScenarioNode) \
+        -> Dict[str, pd.DataFrame]:
+    """
+    runs all scenarios of a scenario tree, computing shared segments once
+
+    :param state: the state of the mortgage at the start of the root segment,
+    see MortgageLoanRunner.snapshot
+    :param root: the root of the scenario tree
+    :return: dictionary with a dataframe per leaf of the tree, with the same
+    layout as MortgageLoanRunner.to_dataframe
+
+    The computation cost is proportional to the total number of periods in
+    the distinct segments of the tree, not to the number of scenarios times
+    the number of periods.
+    """
+    results = {}
+    # each item holds a node, the state before its rate changes and the
+    # payments of the segments of its ancestors
+    stack = [(root, root.name, state, [])]
+    while stack:
+        node, name, node_state, history = stack.pop()
+        if node.rates is not None:
+            node_state = node_state.with_rates(node.rates)
+        payments, end_state = run_segment(node_state, node.periods)
+        history = history + [payments]
+
+        if not node.children:
+            results[name] = _history_to_dataframe(history, state.period)
+        for child in reversed(node.children):
+            stack.append((child, name + '/' + child.name, end_state, history))
+    return results
+
+
+def _history_to_dataframe(history, first_period):
+    """concatenates the payments of a list of segments into a dataframe"""
+    data = {column: np.concatenate([getattr(payments, column)
+                                    for payments in history])
+            for column in PAYMENT_COLUMNS}
+    n_periods = len(data['amount'])
+    index = pd.RangeIndex(first_period, first_period + n_periods, name='period')
+    return pd.DataFrame(data, index=index)
@@ -0,0 +1,302 @@
+"""
+Local scenario pricing service with request micro-batching
+
+The service accepts scenario requests over plain HTTP on a TCP port or a unix
+socket. Requests that arrive within a few milliseconds of each other are
+coalesced into one call to the batch engine, and the results are fanned back
+out to the waiting connections. Run it with
+
+    python -m mortgage_scenarios.service --port 8080
+
+and post a request to /evaluate, for example
+
+    {"loanparts": [{"amount": 200000, "rate": 0.02, "periods": 30, "yearly": true}],
+     "start_year_month": "2020-10"}
+
+Without start_year_month the response holds the monthly columns of
+MortgageLoanRunner.to_dataframe, with it the yearly columns of group_by_year.
+GET /metrics returns the latency and throughput metrics of the batcher.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from functools import partial
+
+import numpy as np
+
+from .batch import PAYMENT_COLUMNS, YEAR_COLUMNS, batch_payments, sum_loanparts
+from .utils import get_monthly_rate
+
+
+def _loanpart_arrays(requests):
+    """
+    converts the loanparts of the requests into arrays of shape
+    (n_requests, max_loanparts), padded with empty loanparts
+    """
+    n_parts = max(len(request['loanparts']) for request in requests)
+    shape = (len(requests), n_parts)
+    arrays = {'amount': np.zeros(shape), 'rate': np.zeros(shape),
+              'npers': np.ones(shape, dtype=int), 'fv': np.zeros(shape),
+              'fixed': np.zeros(shape)}
+    for i_request, request in enumerate(requests):
+        for i_part, loanpart in enumerate(request['loanparts']):
+            rate, periods = loanpart['rate'], loanpart['periods']
+            if loanpart.get('yearly', False):
+                rate, periods = get_monthly_rate(rate), periods * 12
+            arrays['amount'][i_request, i_part] = loanpart['amount']
+            arrays['rate'][i_request, i_part] = rate
+            arrays['npers'][i_request, i_part] = periods
+            arrays['fv'][i_request, i_part] = loanpart.get('future', 0.)
+            arrays['fixed'][i_request, i_part] = loanpart.get('fixed', 0.)
+    return arrays
+
+
+def evaluate_scenarios(requests):
+    """
+    evaluates a list of scenario requests with one call to the batch engine per
+    granularity
+
+    :param requests: list of dictionaries with a list of loanparts, each with
+    amount, rate and periods and optionally future, fixed and yearly. An
+    optional start_year_month requests yearly aggregates.
+    :return: list of dictionaries with a list of values per column
+    """
+    results = [None] * len(requests)
+    monthly = [i for i, request in enumerate(requests)
+               if request.get('start_year_month') is None]
+    if monthly:
+        arrays = _loanpart_arrays([requests[i] for i in monthly])
+        totals = sum_loanparts(batch_payments(**arrays))
+        n_periods = arrays['npers'].max(axis=1)
+        for row, i_request in enumerate(monthly):
+            results[i_request] = {
+                'period': list(range(n_periods[row])),
+                **{column: getattr(totals, column)[row, :n_periods[row]].tolist()
+                   for column in PAYMENT_COLUMNS}}
+
+    # yearly requests are grouped by start month, as it sets the year boundaries
+    starts = {request['start_year_month'] for request in requests
+              if request.get('start_year_month') is not None}
+    for start in starts:
+        indices = [i for i, request in enumerate(requests)
+                   if request.get('start_year_month') == start]
+        arrays = _loanpart_arrays([requests[i] for i in indices])
+        totals = sum_loanparts(batch_payments(**arrays, granularity='year',
+                                              start_year_month=start))
+        for row, i_request in enumerate(indices):
+            has_payments = totals.months[row] > 0
+            results[i_request] = {
+                'year': totals.years[has_payments].tolist(),
+                **{column: getattr(totals, column)[row, has_payments].tolist()
+                   for column in YEAR_COLUMNS}}
+    return results
+
+
+class MicroBatcher:
+    """
+    coalesces requests that arrive close together into batch evaluations
+
+    :param evaluate: function that takes a list of requests and returns a list
+    with a result for each request. It runs in a worker thread, so the event
+    loop keeps accepting requests while a batch is evaluated.
+    :param max_batch_size: the maximum number of requests in a batch
+    :param max_wait: the maximum time in seconds the first request of a batch
+    waits for other requests
+    """
+
+    def __init__(self, evaluate=evaluate_scenarios, max_batch_size=256,
+                 max_wait=0.005, latency_window=10000):
+        self.evaluate = evaluate
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = None
+        self._task = None
+        self._latencies = deque(maxlen=latency_window)
+        self._batch_sizes = deque(maxlen=latency_window)
+        self._n_requests = 0
+        self._started = time.perf_counter()
+
+    async def start(self):
+        """starts the batching task on the running event loop"""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        self._started = time.perf_counter()
+
+    async def stop(self):
+        """stops the batching task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, request):
+        """submits a request and returns its result once its batch is done"""
+        if self._task is None:
+            raise RuntimeError('MicroBatcher is not started')
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        """waits for a first request and collects more until full or timed out"""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            requests = [request for request, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self.evaluate, requests)
+            except Exception:
+                # evaluate the requests one by one, so an invalid request only
+                # fails its own caller
+                results = await loop.run_in_executor(None, self._evaluate_each,
+                                                     requests)
+
+            finished = time.perf_counter()
+            self._batch_sizes.append(len(batch))
+            self._n_requests += len(batch)
+            for (_, future, submitted), result in zip(batch, results):
+                self._latencies.append(finished - submitted)
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _evaluate_each(self, requests):
+        results = []
+        for request in requests:
+            try:
+                results.extend(self.evaluate([request]))
+            except Exception as error:
+                results.append(error)
+        return results
+
+    def metrics(self):
+        """returns latency and throughput metrics of the recent requests"""
+        latencies = np.array(self._latencies) * 1000
+        elapsed = time.perf_counter() - self._started
+        return {
+            'requests': self._n_requests,
+            'batches': len(self._batch_sizes),
+            'mean_batch_size': float(np.mean(self._batch_sizes))
+            if self._batch_sizes else 0.,
+            'latency_ms_p50': float(np.percentile(latencies, 50))
+            if len(latencies) else 0.,
+            'latency_ms_p95': float(np.percentile(latencies, 95))
+            if len(latencies) else 0.,
+            'throughput_per_s': self._n_requests / elapsed if elapsed > 0 else 0.,
+        }
+
+
+def _check_request(request):
+    """raises a ValueError if the request is not a valid scenario request"""
+    if not isinstance(request, dict):
+        raise ValueError('request should be a JSON object')
+    loanparts = request.get('loanparts')
+    if not isinstance(loanparts, list) or not loanparts:
+        raise ValueError('request should have a non-empty list of loanparts')
+    if not all(isinstance(loanpart, dict) for loanpart in loanparts):
+        raise ValueError('loanparts should be JSON objects')
+
+
+async def _write_response(writer, status, body):
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+               500: 'Internal Server Error'}
+    data = json.dumps(body).encode()
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+                 'Content-Length: {}\r\nConnection: close\r\n\r\n'
+                 .format(status, reasons[status], len(data)).encode() + data)
+    await writer.drain()
+    writer.close()
+
+
+async def handle_connection(batcher: MicroBatcher, reader, writer):
+    """handles a single HTTP request on a connection"""
+    try:
+        request_line = (await reader.readline()).decode().split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        if len(request_line) < 2:
+            return await _write_response(writer, 400, {'error': 'invalid request'})
+
+        method, path = request_line[:2]
+        if method == 'GET' and path == '/metrics':
+            return await _write_response(writer, 200, batcher.metrics())
+        if method != 'POST' or path != '/evaluate':
+            return await _write_response(writer, 404, {'error': 'not found'})
+
+        try:
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            request = json.loads(body)
+            _check_request(request)
+            result = await batcher.submit(request)
+        except (ValueError, KeyError, TypeError) as error:
+            return await _write_response(writer, 400, {'error': str(error)})
+        await _write_response(writer, 200, result)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        writer.close()
+    except Exception as error:
+        await _write_response(writer, 500, {'error': str(error)})
+
+
+async def start_server(host='127.0.0.1', port=8080, path=None, max_batch_size=256,
+                       max_wait=0.005):
+    """
+    starts the service on a TCP port, or on a unix socket if path is given
+
+    :return: the asyncio server and the MicroBatcher
+    """
+    batcher = MicroBatcher(max_batch_size=max_batch_size, max_wait=max_wait)
+    await batcher.start()
+    handler = partial(handle_connection, batcher)
+    if path is not None:
+        server = await asyncio.start_unix_server(handler, path=path)
+    else:
+        server = await asyncio.start_server(handler, host=host, port=port)
+    return server, batcher
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='local scenario pricing service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix-socket', default=None)
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-wait-ms', type=float, default=5.)
+    args = parser.parse_args(argv)
+
+    async def _serve():
+        server, _ = await start_server(args.host, args.port, args.unix_socket,
+                                       args.max_batch_size, args.max_wait_ms / 1000)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(_serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Mergeable quantile sketches of payment distributions per period
+
+Monte-Carlo runs produce the payments of many simulated paths for every
+period. A QuantileSketch keeps a compressed summary of the values of each
+period from which quantiles such as P5/P50/P95 are estimated, without keeping
+the values of all paths. Sketches are updated with chunks of paths, can be
+merged across workers and serialized to bytes.
+
+The sketch is a KLL-style stack of compactors. Level h holds items with weight
+2 ** h; when a level is full it is sorted and every other item moves to the
+next level. All periods receive the same number of values, so the levels of
+all periods are compacted together and each level is one array of shape
+(n_periods, n_items). The memory is O(k log(n / k)) items per period and the
+rank error is of the order 1 / k.
+"""
+import io
+
+import numpy as np
+
+from .core import PaymentData
+
+
+class QuantileSketch:
+    """
+    quantile sketch of the values of each period
+
+    :param n_periods: the number of periods
+    :param k: the capacity of each compactor level, higher is more accurate
+    :param seed: seed of the random offsets used in the compactions
+    """
+
+    def __init__(self, n_periods, k=256, seed=None):
+        self.n_periods = n_periods
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty((n_periods, 0))]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        """
+        adds the values of a chunk of paths
+
+        :param values: array of shape (n_paths, n_periods)
+        """
+        values = np.asarray(values, dtype=float)
+        if values.ndim != 2 or values.shape[1] != self.n_periods:
+            raise ValueError('values with shape (n_paths, {}) expected, got {}'
+                             .format(self.n_periods, values.shape))
+        self.levels[0] = np.concatenate([self.levels[0], values.T], axis=1)
+        self.count += values.shape[0]
+        self._compress()
+        return self
+
+    def merge(self, other: 'QuantileSketch'):
+        """adds the items of another sketch of the same periods"""
+        if other.n_periods != self.n_periods:
+            raise ValueError('cannot merge sketches of {} and {} periods'
+                             .format(self.n_periods, other.n_periods))
+        for height, items in enumerate(other.levels):
+            if height == len(self.levels):
+                self.levels.append(np.empty((self.n_periods, 0)))
+            self.levels[height] = np.concatenate([self.levels[height], items], axis=1)
+        self.count += other.count
+        self._compress()
+        return self
+
+    def _compress(self):
+        height = 0
+        while height < len(self.levels):
+            items = self.levels[height]
+            if items.shape[1] >= self.k:
+                # an odd item stays behind, the others are halved
+                n_compact = items.shape[1] - items.shape[1] % 2
+                items = np.sort(items, axis=1)
+                offset = self._rng.integers(2)
+                promoted = items[:, offset:n_compact:2]
+                self.levels[height] = items[:, n_compact:]
+                if height + 1 == len(self.levels):
+                    self.levels.append(np.empty((self.n_periods, 0)))
+                self.levels[height + 1] = np.concatenate(
+                    [self.levels[height + 1], promoted], axis=1)
+            height += 1
+
+    def quantiles(self, q):
+        """
+        estimates quantiles of the values of each period
+
+        :param q: quantile or sequence of quantiles between 0 and 1
+        :return: array of shape (len(q), n_periods), or (n_periods,) for a
+        single quantile
+        """
+        if self.count == 0:
+            raise ValueError('the sketch is empty')
+        items = np.concatenate(self.levels, axis=1)
+        weights = np.concatenate([np.full(level.shape[1], 2. ** height)
+                                  for height, level in enumerate(self.levels)])
+        order = np.argsort(items, axis=1)
+        items = np.take_along_axis(items, order, axis=1)
+        cumulative = np.cumsum(weights[order], axis=1)
+        q = np.asarray(q, dtype=float)
+        targets = np.atleast_1d(q)[:, None, None] * cumulative[:, -1:]
+        # the first item at which the cumulative weight reaches the rank
+        index = np.minimum((cumulative[None] < targets).sum(axis=-1),
+                           items.shape[1] - 1)
+        result = np.take_along_axis(items[None], index[..., None], axis=-1)[..., 0]
+        return result[0] if q.ndim == 0 else result
+
+    def to_bytes(self):
+        """serializes the sketch"""
+        buffer = io.BytesIO()
+        levels = {'level_{}'.format(h): level for h, level in enumerate(self.levels)}
+        np.savez(buffer, meta=np.array([self.n_periods, self.k, self.count]),
+                 **levels)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data, seed=None):
+        """restores a sketch serialized with to_bytes"""
+        with np.load(io.BytesIO(data)) as arrays:
+            n_periods, k, count = (int(x) for x in arrays['meta'])
+            sketch = cls(n_periods, k, seed)
+            sketch.count = count
+            sketch.levels = [arrays['level_{}'.format(h)]
+                             for h in range(len(arrays.files) - 1)]
+        return sketch
+
+
+class PaymentSketches:
+    """
+    quantile sketches of the monthly payment, the balance and the cumulative
+    interest of simulated mortgages
+
+    :param n_periods: the number of periods
+    :param k: the capacity of the compactor levels, see QuantileSketch
+    :param seed: seed of the random offsets
+    """
+
+    columns = ('payment', 'amount', 'cumulative_interest')
+
+    def __init__(self, n_periods, k=256, seed=None):
+        rng = np.random.default_rng(seed)
+        self.sketches = {column: QuantileSketch(n_periods, k, rng.integers(2 ** 32))
+                         for column in self.columns}
+
+    def update(self, payments: PaymentData):
+        """
+        adds a chunk of runner output, with arrays of shape (n_paths, n_periods)
+        """
+        self.sketches['payment'].update(payments.payment)
+        self.sketches['amount'].update(payments.amount)
+        self.sketches['cumulative_interest'].update(
+            np.cumsum(payments.interest, axis=-1))
+        return self
+
+    def merge(self, other: 'PaymentSketches'):
+        """adds the sketches of another worker"""
+        for column in self.columns:
+            self.sketches[column].merge(other.sketches[column])
+        return self
+
+    def quantiles(self, q=(0.05, 0.5, 0.95)):
+        """returns the estimated quantiles of each column per period"""
+        return {column: sketch.quantiles(q) for column, sketch in self.sketches.items()}
+
+    def to_bytes(self):
+        """serializes the sketches"""
+        buffer = io.BytesIO()
+        np.savez(buffer, **{column: np.frombuffer(sketch.to_bytes(), dtype=np.uint8)
+                            for column, sketch in self.sketches.items()})
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """restores sketches serialized with to_bytes"""
+        with np.load(io.BytesIO(data)) as arrays:
+            sketches = {column: QuantileSketch.from_bytes(arrays[column].tobytes())
+                        for column in cls.columns}
+        instance = cls.__new__(cls)
+        instance.sketches = sketches
+        return instance
@@ -0,0 +1,190 @@
+"""
+Local store of sweep results with a summary index per scenario
+
+For every scenario the store keeps the full monthly results of all mortgages
+as columnar .npy files, and an index with summary statistics per mortgage:
+the maximum monthly payment, the total interest, the payoff period and the
+loan-to-value at the start, its maximum and the period it first drops to the
+LTV threshold. Queries are evaluated on the index first and only the rows of
+the matching mortgages are read from the memory-mapped full results:
+
+    store = ResultStore('results')
+    store.add('rates+2%', payments, house_value=house_values)
+    result = store.query('ltv_start > 0.9 and max_payment > 2000',
+                         scenarios=['rates+2%'])
+
+The layout of the directory is
+
+    results/<scenario_id>/index.npz
+    results/<scenario_id>/amount.npy, interest.npy, repayment.npy
+"""
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .core import PaymentData
+from .utils import write_atomic
+
+STORED_COLUMNS = ('amount', 'interest', 'repayment')
+SUMMARY_COLUMNS = ('max_payment', 'total_interest', 'payoff_period', 'ltv_start',
+                   'ltv_max', 'ltv_crossing_period')
+LTV_THRESHOLD = 0.9
+
+
+def _first_period(condition):
+    """the first period where condition holds along the last axis, -1 if never"""
+    return np.where(condition.any(axis=-1), np.argmax(condition, axis=-1), -1)
+
+
+def summarize(payments: PaymentData, house_value=None, ltv_threshold=LTV_THRESHOLD):
+    """
+    computes the summary statistics of mortgages
+
+    :param payments: PaymentData with arrays of shape (n_mortgages, n_periods)
+    :param house_value: the value of the house of each mortgage, with shape
+    (n_mortgages,) or per period (n_mortgages, n_periods). Without house values
+    the LTV columns are nan.
+    :param ltv_threshold: the LTV of the crossing period
+    :return: dictionary with an array of shape (n_mortgages,) per column of
+    SUMMARY_COLUMNS
+
+    The payoff period is the first period after which less than a cent is
+    left, -1 for mortgages that are not paid off. The crossing period is the
+    first period that starts with an LTV at or below the threshold, -1 if the
+    LTV stays above it. Only the periods with payments count, not the zero
+    periods after the end of mortgages that are shorter than the batch.
+    """
+    amount = np.asarray(payments.amount, dtype=float)
+    active = (payments.amount != 0) | (payments.interest != 0) | \
+        (payments.repayment != 0)
+    summary = {
+        'max_payment': np.max(payments.payment, axis=-1).astype(float),
+        'total_interest': np.sum(payments.interest, axis=-1).astype(float),
+        'payoff_period': _first_period(active & (np.abs(payments.amount_end) < 0.005)),
+    }
+    if house_value is None:
+        nan = np.full(len(amount), np.nan)
+        summary.update(ltv_start=nan, ltv_max=nan,
+                       ltv_crossing_period=np.full(len(amount), -1))
+        return summary
+
+    house_value = np.asarray(house_value, dtype=float)
+    if house_value.ndim == 1:
+        house_value = house_value[:, None]
+    ltv = amount / house_value
+    summary.update(ltv_start=ltv[:, 0], ltv_max=ltv.max(axis=-1),
+                   ltv_crossing_period=_first_period(active & (ltv <= ltv_threshold)))
+    return summary
+
+
+@dataclass
+class QueryResult:
+    """
+    dataclass with the result of a query on a ResultStore
+
+    summary: the index rows of the matching mortgages, with a scenario column
+    payments: the full results of the matching mortgages per scenario
+    """
+
+    summary: pd.DataFrame
+    payments: dict
+
+
+class ResultStore:
+    """
+    store of the results of scenarios in a local directory
+
+    :param directory: the directory of the store, created if it does not exist
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._indices = {}
+
+    def _path(self, scenario_id, name):
+        return os.path.join(self.directory, scenario_id, name)
+
+    def scenarios(self):
+        """returns the ids of the stored scenarios"""
+        return sorted(name for name in os.listdir(self.directory)
+                      if os.path.exists(self._path(name, 'index.npz')))
+
+    def add(self, scenario_id, payments: PaymentData, house_value=None,
+            mortgage_ids=None, ltv_threshold=LTV_THRESHOLD):
+        """
+        stores the results of a scenario, replacing earlier results
+
+        :param scenario_id: the id of the scenario, used as directory name
+        :param payments: PaymentData of the mortgages, for example the totals
+        of sum_loanparts, with shape (n_mortgages, n_periods)
+        :param house_value: see summarize
+        :param mortgage_ids: ids of the mortgages, by default their row number
+        :param ltv_threshold: see summarize
+        """
+        if not scenario_id or os.sep in scenario_id or scenario_id.startswith('.'):
+            raise ValueError('invalid scenario id {!r}'.format(scenario_id))
+        n_mortgages = len(payments.amount)
+        if mortgage_ids is None:
+            mortgage_ids = np.arange(n_mortgages)
+        os.makedirs(os.path.join(self.directory, scenario_id), exist_ok=True)
+
+        for column in STORED_COLUMNS:
+            values = np.ascontiguousarray(getattr(payments, column))
+            write_atomic(self._path(scenario_id, column + '.npy'),
+                         lambda file: np.save(file, values))
+        # the index is written last, so a scenario is only listed when complete
+        summary = summarize(payments, house_value, ltv_threshold)
+        write_atomic(self._path(scenario_id, 'index.npz'),
+                     lambda file: np.savez(file, mortgage_id=np.asarray(mortgage_ids),
+                                           ltv_threshold=ltv_threshold, **summary))
+        self._indices.pop(scenario_id, None)
+
+    def summary(self, scenario_id):
+        """returns the index of a scenario as a dataframe"""
+        if scenario_id not in self._indices:
+            with np.load(self._path(scenario_id, 'index.npz')) as arrays:
+                df = pd.DataFrame({column: arrays[column]
+                                   for column in ('mortgage_id',) + SUMMARY_COLUMNS})
+            df.insert(0, 'scenario', scenario_id)
+            self._indices[scenario_id] = df
+        return self._indices[scenario_id]
+
+    def load(self, scenario_id, rows=None):
+        """
+        returns the full results of a scenario
+
+        :param rows: the row numbers of the mortgages to read, by default the
+        memory-mapped arrays of all mortgages are returned
+        """
+        columns = {column: np.load(self._path(scenario_id, column + '.npy'),
+                                   mmap_mode='r') for column in STORED_COLUMNS}
+        if rows is not None:
+            columns = {column: values[np.asarray(rows)]
+                       for column, values in columns.items()}
+        return PaymentData(**columns)
+
+    def query(self, expression, scenarios=None):
+        """
+        selects mortgages with an expression on the summary columns
+
+        :param expression: a pandas query on the columns of SUMMARY_COLUMNS,
+        mortgage_id and scenario, for example 'ltv_start > 0.9 and max_payment > 2000'
+        :param scenarios: the scenarios to search, by default all scenarios
+        :return: QueryResult with the full results of only the matching rows
+        """
+        summaries, payments = [], {}
+        for scenario_id in scenarios or self.scenarios():
+            summary = self.summary(scenario_id)
+            rows = np.flatnonzero(summary.eval(expression).values)
+            if len(rows) == 0:
+                continue
+            summaries.append(summary.iloc[rows].assign(row=rows))
+            payments[scenario_id] = self.load(scenario_id, rows)
+        if not summaries:
+            columns = ['scenario', 'mortgage_id'] + list(SUMMARY_COLUMNS) + ['row']
+            return QueryResult(summary=pd.DataFrame(columns=columns), payments={})
+        return QueryResult(summary=pd.concat(summaries, ignore_index=True),
+                           payments=payments)
@@ -0,0 +1,159 @@
+"""
+Resumable sweeps of rate scenarios over a book of mortgages
+
+A sweep runs every rate scenario over every chunk of loans of a book with the
+batch engine, and writes each finished chunk to a results directory. Chunk
+files are first written to a temporary file and then moved into place, so a
+killed job never leaves half a chunk behind. A manifest.json in the directory
+records the library version and a hash of the parameters of each finished
+chunk. Running the sweep again skips the chunks of the manifest whose hash
+still matches and only computes the chunks that are missing or stale, for
+example after the rates of a scenario or the book were changed.
+
+The directory has the layout
+
+    results/manifest.json
+    results/<scenario_id>/chunk_00000.npz
+    ...
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from . import __version__
+from .batch import batch_schedule, get_chunk_size
+from .core import PaymentData
+from .utils import write_atomic
+
+MANIFEST = 'manifest.json'
+BOOK_COLUMNS = ('amount', 'npers', 'fv', 'fixed')
+
+
+def _parameter_hash(*arrays):
+    """hash of the library version and the dtype, shape and values of arrays"""
+    digest = hashlib.sha256(__version__.encode())
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update('{}{}'.format(array.dtype.str, array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def read_manifest(directory):
+    """returns the manifest of a results directory, empty if there is none"""
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {'version': __version__, 'scenarios': {}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _chunk_path(directory, scenario_id, chunk):
+    return os.path.join(directory, scenario_id, 'chunk_{:05d}.npz'.format(chunk))
+
+
+def run_sweep(directory, book, scenarios, chunk_size=None, max_workers=None):
+    """
+    runs rate scenarios over a book of loanparts and stores the results per chunk
+
+    :param directory: the results directory, created if it does not exist
+    :param book: dictionary with arrays amount and npers and optionally fv and
+    fixed, with the loans on the first axis
+    :param scenarios: dictionary of scenario id to rates per period, with a
+    trailing period axis and broadcastable against the book like the rates of
+    batch_schedule. Rates with the loans on the first axis and one axis more
+    than the amounts of the book are split in chunks with the book; rates with
+    fewer axes, like a single rate curve, are used for all loans.
+    :param chunk_size: the number of loans per chunk file
+    :param max_workers: the number of threads computing chunks
+    :return: dictionary with the number of computed and skipped chunks
+    """
+    book = {column: np.asarray(book.get(column, 0.)) for column in BOOK_COLUMNS}
+    n_loans = len(book['amount'])
+    loan_ndim = book['amount'].ndim
+    n_periods = max(int(np.max(book['npers'])),
+                    max(np.shape(rates)[-1] for rates in scenarios.values()))
+    if chunk_size is None:
+        chunk_size = get_chunk_size(n_periods, int(np.prod(book['amount'].shape[1:])))
+    starts = range(0, n_loans, chunk_size)
+
+    def _rows(array, start, ndim):
+        """the rows of a chunk of arrays with ndim axes and the loans first"""
+        array = np.asarray(array)
+        if array.ndim == ndim and array.shape[0] == n_loans:
+            return array[start:start + chunk_size]
+        return array
+
+    manifest = read_manifest(directory)
+    manifest['version'] = __version__
+    tasks = []
+    for scenario_id, rates in scenarios.items():
+        if not scenario_id or os.sep in scenario_id or scenario_id.startswith('.'):
+            raise ValueError('invalid scenario id {!r}'.format(scenario_id))
+        os.makedirs(os.path.join(directory, scenario_id), exist_ok=True)
+        scenario = manifest['scenarios'].setdefault(scenario_id, {'chunks': {}})
+        scenario['n_chunks'] = len(starts)
+        done = scenario['chunks']
+        for chunk in [chunk for chunk in done if int(chunk) >= len(starts)]:
+            del done[chunk]
+        for chunk, start in enumerate(starts):
+            inputs = {column: _rows(book[column], start, loan_ndim)
+                      for column in BOOK_COLUMNS}
+            inputs['rates'] = _rows(rates, start, loan_ndim + 1)
+            parameter_hash = _parameter_hash(
+                np.array([n_periods]), *(inputs[key] for key in sorted(inputs)))
+            if done.get(str(chunk)) == parameter_hash and \
+                    os.path.exists(_chunk_path(directory, scenario_id, chunk)):
+                continue
+            done.pop(str(chunk), None)
+            tasks.append((scenario_id, chunk, inputs, parameter_hash))
+
+    def _run_chunk(scenario_id, chunk, inputs, parameter_hash):
+        payments = batch_schedule(n_periods=n_periods, **inputs)
+        write_atomic(_chunk_path(directory, scenario_id, chunk),
+                     lambda file: np.savez(file, amount=payments.amount,
+                                           interest=payments.interest,
+                                           repayment=payments.repayment))
+        return scenario_id, chunk, parameter_hash
+
+    def _write_manifest():
+        write_atomic(os.path.join(directory, MANIFEST),
+                     lambda file: file.write(json.dumps(manifest, indent=1).encode()))
+
+    os.makedirs(directory, exist_ok=True)
+    _write_manifest()
+    # the manifest is only written from this thread, after a chunk is on disk
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_run_chunk, *task) for task in tasks]
+        for future in as_completed(futures):
+            scenario_id, chunk, parameter_hash = future.result()
+            manifest['scenarios'][scenario_id]['chunks'][str(chunk)] = parameter_hash
+            _write_manifest()
+
+    n_chunks = len(starts) * len(scenarios)
+    return {'computed': len(tasks), 'skipped': n_chunks - len(tasks)}
+
+
+def load_sweep(directory, scenario_id):
+    """
+    loads the results of a scenario of a finished sweep
+
+    :return: PaymentData with the chunks concatenated along the loan axis
+    """
+    scenario = read_manifest(directory)['scenarios'].get(scenario_id)
+    if scenario is None:
+        raise KeyError('no results for scenario {!r}'.format(scenario_id))
+    indices = sorted(int(chunk) for chunk in scenario['chunks'])
+    if indices != list(range(scenario['n_chunks'])):
+        raise ValueError('the sweep of scenario {!r} is not complete'
+                         .format(scenario_id))
+    columns = {'amount': [], 'interest': [], 'repayment': []}
+    for chunk in indices:
+        with np.load(_chunk_path(directory, scenario_id, chunk)) as arrays:
+            for column, values in columns.items():
+                values.append(arrays[column])
+    return PaymentData(**{column: np.concatenate(values)
+                          for column, values in columns.items()})
@@ -0,0 +1,205 @@
+"""
+Precomputed annuity tables for a grid of quoted rates and terms
+
+Products are offered for a small set of terms and with yearly rates quoted in
+basis point steps. An AnnuityTable holds for each rate of the grid the monthly
+rate, and for each rate and term the annuity factor (the payment per unit of
+loan amount) and the balance factors (the remaining balance per unit of loan
+amount after each period). Pricing then reduces to gathering from the tables.
+
+Rates on the grid are looked up exactly, the results equal get_monthly_rate,
+get_annuity_payment and get_balance_after up to floating point rounding. Rates
+between grid points are interpolated linearly. A batch of quoted rates takes
+a single gather per table, interpolation needs a second one. Terms should be
+in the table.
+
+Tables are saved as a directory of .npy files, so that worker processes can
+load them memory-mapped and share a single read-only copy of the pages:
+
+    table = AnnuityTable.build(range(100, 701), range(10, 31))
+    table.save('annuity_table')
+    table = AnnuityTable.load('annuity_table')  # memory-mapped by default
+"""
+import math
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from .utils import get_annuity_payment, get_balance_after, get_monthly_rate
+
+TABLE_ARRAYS = ('rates_bp', 'terms', 'monthly_rates', 'annuity_factors',
+                'balance_factors')
+
+
+@dataclass
+class AnnuityTable:
+    """
+    dataclass with annuity factors of a grid of yearly rates and terms
+
+    rates_bp: the yearly rates in basis points, equally spaced, (n_rates,)
+    terms: the terms in years, (n_terms,)
+    monthly_rates: the monthly rate of each yearly rate, (n_rates,)
+    annuity_factors: the monthly payment per unit amount, (n_rates, n_terms)
+    balance_factors: the balance per unit amount after each period of an
+    annuity with future value 0, (n_rates, n_terms, max term * 12 + 1)
+    """
+
+    rates_bp: np.ndarray
+    terms: np.ndarray
+    monthly_rates: np.ndarray
+    annuity_factors: np.ndarray
+    balance_factors: np.ndarray
+
+    @classmethod
+    def build(cls, rates_bp, terms):
+        """
+        computes the tables
+
+        :param rates_bp: equally spaced yearly rates in basis points
+        :param terms: terms in years
+        """
+        rates_bp = np.asarray(rates_bp, dtype=float)
+        steps = np.diff(rates_bp)
+        if len(rates_bp) > 1 and not np.allclose(steps, steps[0]) or np.any(steps <= 0):
+            raise ValueError('rates_bp should be increasing in equal steps')
+        terms = np.asarray(terms, dtype=int)
+        monthly_rates = get_monthly_rate(rates_bp / 10000)
+        npers = terms * 12
+        annuity_factors = get_annuity_payment(monthly_rates[:, None], npers, 1.)
+        periods = np.arange(npers.max() + 1)
+        balance_factors = get_balance_after(monthly_rates[:, None, None], periods,
+                                            1., annuity_factors[..., None])
+        balance_factors = np.where(periods <= npers[:, None], balance_factors, 0.)
+        # the last balance is zero by construction, remove the rounding error
+        balance_factors[:, np.arange(len(terms)), npers] = 0.
+        return cls(rates_bp=rates_bp, terms=terms, monthly_rates=monthly_rates,
+                   annuity_factors=annuity_factors, balance_factors=balance_factors)
+
+    def save(self, path):
+        """saves the tables as .npy files in the directory path"""
+        os.makedirs(path, exist_ok=True)
+        for name in TABLE_ARRAYS:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """loads tables saved with save, memory-mapped unless mmap_mode is None"""
+        return cls(**{name: np.load(os.path.join(path, name + '.npy'),
+                                    mmap_mode=mmap_mode)
+                      for name in TABLE_ARRAYS})
+
+    def __post_init__(self):
+        # conversions used by every lookup, derived once from the tables
+        self._rate_start = float(self.rates_bp[0]) / 10000
+        self._rate_scale = 10000 / float(self.rates_bp[1] - self.rates_bp[0]) \
+            if len(self.rates_bp) > 1 else 1.
+        self._term_lookup = np.full(int(np.max(self.terms)) + 1, -1, dtype=np.intp)
+        self._term_lookup[self.terms] = np.arange(len(self.terms))
+
+    def _rate_index(self, rate):
+        """
+        returns the lower grid index and the interpolation weight of yearly rates
+
+        the weight is None if all rates are on the grid
+        """
+        if np.ndim(rate) == 0:
+            return self._scalar_rate_index(float(rate))
+        position = (np.asarray(rate, dtype=float) - self._rate_start) * self._rate_scale
+        index = np.rint(position)
+        # rates quoted in basis points are on the grid despite rounding
+        on_grid = np.abs(position - index) < 1e-6
+        if np.all(on_grid):
+            lower, weight = index.astype(np.intp), None
+            low, high = np.min(lower), np.max(lower)
+        else:
+            position = np.where(on_grid, index, position)
+            low, high = np.min(position), np.max(position)
+            lower = np.minimum(position.astype(np.intp), len(self.rates_bp) - 2)
+            weight = position - lower
+        if low < 0 or high > len(self.rates_bp) - 1:
+            raise ValueError('rates outside the table range of {} to {} bp'
+                             .format(self.rates_bp[0], self.rates_bp[-1]))
+        return lower, weight
+
+    def _scalar_rate_index(self, rate):
+        """_rate_index of a single rate, without the overhead of numpy arrays"""
+        position = (rate - self._rate_start) * self._rate_scale
+        index = round(position)
+        if abs(position - index) < 1e-6:
+            lower, weight = index, None
+        else:
+            lower = min(math.floor(position), len(self.rates_bp) - 2)
+            weight = position - lower
+        if lower < 0 or position > len(self.rates_bp) - 1 + 1e-6:
+            raise ValueError('rates outside the table range of {} to {} bp'
+                             .format(self.rates_bp[0], self.rates_bp[-1]))
+        return lower, weight
+
+    def _term_index(self, term):
+        if np.ndim(term) == 0:
+            index = self._term_lookup[int(term)] if 0 <= term < len(self._term_lookup) \
+                else -1
+            if index < 0 or term != int(term):
+                raise ValueError('terms should be in the table {}'.format(self.terms))
+            return int(index)
+        term = np.asarray(term)
+        if np.any(term < 0) or np.any(term >= len(self._term_lookup)) or \
+                np.any(self._term_lookup[term] < 0):
+            raise ValueError('terms should be in the table {}'.format(self.terms))
+        return self._term_lookup[term]
+
+    @staticmethod
+    def _take(table, lower, weight, index=0):
+        """
+        gathers from a table with rates on the first axis, interpolating rates
+
+        index is the flat index into the other axes of the table
+        """
+        values = table.reshape(-1)
+        size = values.size // len(table)
+        flat = lower * size + index
+        result = np.take(values, flat)
+        if weight is None:
+            return result
+        return result + (np.take(values, flat + size) - result) * weight
+
+    def monthly_rate(self, rate):
+        """the monthly rate of yearly rates, like get_monthly_rate"""
+        return self._take(self.monthly_rates, *self._rate_index(rate))
+
+    def annuity_factor(self, rate, term):
+        """the monthly payment per unit amount for yearly rates and terms in years"""
+        return self._take(self.annuity_factors, *self._rate_index(rate),
+                          self._term_index(term))
+
+    def balance_factor(self, rate, term, period):
+        """the balance per unit amount after a number of periods"""
+        term_index = self._term_index(term)
+        period = np.asarray(period)
+        if np.any(period < 0) or np.any(period > np.asarray(term) * 12):
+            raise ValueError('periods should be between 0 and the term in months')
+        n_periods = self.balance_factors.shape[2]
+        return self._take(self.balance_factors, *self._rate_index(rate),
+                          term_index * n_periods + period)
+
+    def payment(self, amount, rate, term, fv=0.):
+        """
+        the monthly payment of loanparts, like get_annuity_payment
+
+        the payment is linear in amount and fv; an interest-only loan, with
+        fv equal to the amount, pays the monthly rate
+        """
+        lower, weight = self._rate_index(rate)
+        factor = self._take(self.annuity_factors, lower, weight, self._term_index(term))
+        if np.ndim(fv) == 0 and fv == 0:
+            return amount * factor
+        return amount * factor - fv * (factor - self._take(self.monthly_rates,
+                                                           lower, weight))
+
+    def balance(self, amount, rate, term, period, fv=0.):
+        """the balance of loanparts after a number of periods, like get_balance_after"""
+        factor = self.balance_factor(rate, term, period)
+        if np.ndim(fv) == 0 and fv == 0:
+            return amount * factor
+        return amount * factor + fv * (1 - factor)
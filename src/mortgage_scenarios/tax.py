@@ -0,0 +1,204 @@
+"""
+Dutch income tax effects of a mortgage on the own home (hypotheekrenteaftrek)
+
+The net cost of a mortgage is the gross payment minus the tax benefit of the
+mortgage interest deduction. The deductible amount is the interest paid minus
+the eigenwoningforfait, a notional income based on the WOZ value of the home.
+The tax benefit is computed with the box 1 brackets of each year, where the
+rate of the deduction is capped at the maximum deduction rate of that year.
+
+All computations work on arrays with a trailing axis for the years, so many
+mortgages and years are done in one go. Note that the engine counts the fixed
+amount of a loanpart as interest, so it is treated as deductible here as well.
+"""
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .batch import YearlyPayments
+
+
+@dataclass(frozen=True)
+class TaxYear:
+    """
+    dataclass with the tax parameters of a single year
+
+    :param brackets: tuple of (lower bound, rate) for the box 1 income brackets,
+    starting with a lower bound of 0
+    :param max_deduction_rate: the maximum rate against which the interest is
+    deducted
+    :param ewf_rate: the eigenwoningforfait as fraction of the WOZ value
+    :param villa_threshold: WOZ value above which villa_rate applies to the excess
+    :param villa_rate: the eigenwoningforfait rate on the WOZ value above the
+    villa threshold
+    :param hillen_rate: the fraction of the excess of the eigenwoningforfait over
+    the interest that is deducted (Wet Hillen)
+    """
+
+    brackets: Tuple[Tuple[float, float], ...]
+    max_deduction_rate: float
+    ewf_rate: float
+    villa_threshold: float = np.inf
+    villa_rate: float = 0.
+    hillen_rate: float = 0.
+
+
+class TaxRules:
+    """
+    set of TaxYears, indexed by year
+
+    Years after the last configured year use the rules of the last configured
+    year, so projections over the full duration of a mortgage are possible.
+    """
+
+    def __init__(self, tax_years: Dict[int, TaxYear]):
+        if not tax_years:
+            raise ValueError('at least one tax year should be provided')
+        self._tax_years = dict(sorted(tax_years.items()))
+
+    def get(self, year) -> TaxYear:
+        """returns the rules that apply for the given year"""
+        configured = [y for y in self._tax_years if y <= year]
+        if not configured:
+            raise KeyError('no tax rules for year {}, first configured year '
+                           'is {}'.format(year, next(iter(self._tax_years))))
+        return self._tax_years[configured[-1]]
+
+    def to_arrays(self, years):
+        """
+        returns the rules for the given years as arrays
+
+        the bracket arrays have shape (n_years, n_brackets) and are padded
+        with empty brackets, the other arrays have shape (n_years,)
+        """
+        tax_years = [self.get(year) for year in years]
+        n_brackets = max(len(t.brackets) for t in tax_years)
+        lower = np.full((len(tax_years), n_brackets), np.inf)
+        rates = np.zeros((len(tax_years), n_brackets))
+        for i_year, tax_year in enumerate(tax_years):
+            bounds, bracket_rates = zip(*tax_year.brackets)
+            lower[i_year, :len(bounds)] = bounds
+            rates[i_year, :len(bounds)] = bracket_rates
+
+        arrays = {attr: np.array([getattr(t, attr) for t in tax_years], dtype=float)
+                  for attr in ('max_deduction_rate', 'ewf_rate', 'villa_threshold',
+                               'villa_rate', 'hillen_rate')}
+        arrays['lower'] = lower
+        arrays['rates'] = rates
+        return arrays
+
+
+DUTCH_TAX_RULES = TaxRules({
+    2023: TaxYear(brackets=((0., 0.3693), (73031., 0.4950)),
+                  max_deduction_rate=0.3693, ewf_rate=0.0035,
+                  villa_threshold=1200000., villa_rate=0.0235,
+                  hillen_rate=0.83333),
+    2024: TaxYear(brackets=((0., 0.3697), (75518., 0.4950)),
+                  max_deduction_rate=0.3697, ewf_rate=0.0035,
+                  villa_threshold=1310000., villa_rate=0.0235,
+                  hillen_rate=0.80),
+})
+
+
+@dataclass
+class NetCost:
+    """
+    dataclass with the tax effects and net cost of mortgages per year
+
+    interest, eigenwoningforfait, deduction and tax_benefit are yearly totals,
+    net_payment is the mean payment per month after the tax benefit
+    """
+
+    years: np.ndarray
+    interest: np.ndarray
+    eigenwoningforfait: np.ndarray
+    deduction: np.ndarray
+    tax_benefit: np.ndarray
+    net_payment: np.ndarray
+
+    def to_dataframe(self):
+        """returns the data of a single mortgage as dataframe indexed by year"""
+        columns = ['interest', 'eigenwoningforfait', 'deduction', 'tax_benefit',
+                   'net_payment']
+        return pd.DataFrame({column: getattr(self, column) for column in columns},
+                            index=self.years)
+
+
+def _bracket_tax(income, lower, rates):
+    """
+    computes the tax on income for brackets with lower bounds and rates
+
+    income has a trailing axis for the years, lower and rates have shape
+    (n_years, n_brackets)
+    """
+    upper = np.append(lower[:, 1:], np.full((lower.shape[0], 1), np.inf), axis=1)
+    width = np.subtract(upper, lower, out=np.zeros_like(lower),
+                        where=np.isfinite(lower))
+    taxed = np.clip(np.maximum(income, 0.)[..., None] - lower, 0., width)
+    return (taxed * rates).sum(axis=-1)
+
+
+def get_eigenwoningforfait(woz, years, rules: TaxRules = DUTCH_TAX_RULES):
+    """
+    computes the yearly eigenwoningforfait
+
+    :param woz: the WOZ value, broadcastable to (..., n_years)
+    :param years: the years
+    :param rules: the tax rules
+    """
+    arrays = rules.to_arrays(years)
+    woz = np.asarray(woz, dtype=float)
+    standard = np.minimum(woz, arrays['villa_threshold']) * arrays['ewf_rate']
+    villa = np.maximum(woz - arrays['villa_threshold'], 0.) * arrays['villa_rate']
+    return standard + villa
+
+
+def compute_net_cost(yearly: YearlyPayments, woz, income,
+                     rules: TaxRules = DUTCH_TAX_RULES, start_year_month=None,
+                     n_periods=None) -> NetCost:
+    """
+    computes the mortgage interest deduction and the net cost per year
+
+    :param yearly: the yearly payments, see batch_group_by_year, or the
+    dataframe of a single mortgage from group_by_year
+    :param woz: the WOZ value of the homes, broadcastable to the yearly arrays
+    :param income: the taxable box 1 income without the own home,
+    broadcastable to the yearly arrays
+    :param rules: the tax rules per year
+    :param start_year_month: the start period of a group_by_year dataframe
+    :param n_periods: the number of months of a group_by_year dataframe, see
+    YearlyPayments.from_dataframe
+    :return: NetCost
+
+    The tax benefit is the difference between the tax on the income and the tax
+    on the income minus the deduction. If the interest is higher than the
+    eigenwoningforfait, the rates used are capped at the maximum deduction rate.
+    Otherwise the difference is added to the income, reduced by the Wet Hillen
+    deduction, and taxed at the regular rates. In years with payments in part
+    of the months, the eigenwoningforfait is taken pro rata.
+    """
+    if isinstance(yearly, pd.DataFrame):
+        yearly = YearlyPayments.from_dataframe(yearly, start_year_month, n_periods)
+    arrays = rules.to_arrays(yearly.years)
+    interest = yearly.interest * yearly.months
+    ewf = get_eigenwoningforfait(woz, yearly.years, rules)
+    ewf = np.where(yearly.months > 0, ewf * yearly.months / 12, 0.)
+
+    deduction = interest - ewf
+    deduction = np.where(deduction < 0, deduction * (1 - arrays['hillen_rate']),
+                         deduction)
+
+    income = np.asarray(income, dtype=float)
+    capped_rates = np.minimum(arrays['rates'], arrays['max_deduction_rate'][:, None])
+    benefit_capped = _bracket_tax(income, arrays['lower'], capped_rates) - \
+        _bracket_tax(income - deduction, arrays['lower'], capped_rates)
+    benefit_regular = _bracket_tax(income, arrays['lower'], arrays['rates']) - \
+        _bracket_tax(income - deduction, arrays['lower'], arrays['rates'])
+    tax_benefit = np.where(deduction >= 0, benefit_capped, benefit_regular)
+
+    net_payment = yearly.payment - tax_benefit / np.maximum(yearly.months, 1)
+    return NetCost(years=yearly.years, interest=interest, eigenwoningforfait=ewf,
+                   deduction=deduction, tax_benefit=tax_benefit,
+                   net_payment=net_payment)
@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 
 
@@ -15,3 +17,99 @@ def get_monthly_rate(rate) -> float:
     growth_month = np.power(growth_year, 1./12)
     rate_month = growth_month - 1
     return rate_month
+
+
+def get_annuity_payment(rate, npers, amount, fv=0.):
+    """
+    computes the payment per period of an annuity, paid at the end of each period
+
+    :param rate: the interest rate per period
+    :param npers: the number of periods
+    :param amount: the loan amount at the start of the first period
+    :param fv: the amount left after the last payment
+    :return: the payment per period (positive for a positive loan amount)
+
+    This is a vectorized replacement for the deprecated np.pmt function with
+    when='end', such that -np.pmt(rate, npers, amount, -fv) equals
+    get_annuity_payment(rate, npers, amount, fv). A rate of zero is
+    allowed and results in a linear repayment.
+    """
+    rate = np.asarray(rate, dtype=float)
+    temp = np.power(1 + rate, npers)
+    zero_rate = rate == 0
+    masked_rate = np.where(zero_rate, 1., rate)
+    factor = np.where(zero_rate, npers, (temp - 1) / masked_rate)
+    payment = (amount * temp - fv) / factor
+    if np.ndim(payment) == 0:
+        return float(payment)
+    return payment
+
+
+def get_balance_after(rate, periods, amount, payment):
+    """
+    computes the balance of an annuity after a number of periods
+
+    :param rate: the interest rate per period
+    :param periods: the number of periods that have been paid
+    :param amount: the balance at the start
+    :param payment: the constant payment per period, without fixed amounts
+    :return: the balance after the payments of the given number of periods
+
+    This is the closed-form solution of the recurrence
+    balance = balance * (1 + rate) - payment.
+    """
+    rate = np.asarray(rate, dtype=float)
+    zero_rate = rate == 0
+    masked_rate = np.where(zero_rate, 1., rate)
+    growth = np.power(1 + rate, periods)
+    return np.where(zero_rate, amount - payment * periods,
+                    amount * growth - payment * (growth - 1) / masked_rate)
+
+
+def round_cents(value, rounding='half_up'):
+    """
+    rounds amounts expressed in (fractional) cents to whole cents
+
+    :param value: array_like with amounts in cents
+    :param rounding: 'half_up' rounds halves away from zero, which is the
+    convention used by most lenders, 'half_even' rounds halves to the even
+    neighbour (bankers rounding)
+    :return: int64 array with the rounded amounts
+    """
+    value = np.asarray(value, dtype=float)
+    if rounding == 'half_up':
+        rounded = np.copysign(np.floor(np.abs(value) + 0.5), value)
+    elif rounding == 'half_even':
+        rounded = np.rint(value)
+    else:
+        raise ValueError('rounding should be "half_up" or "half_even", '
+                         '"{}" provided'.format(rounding))
+    return rounded.astype(np.int64)
+
+
+def to_cents(amount, rounding='half_up'):
+    """converts amounts in euros to int64 amounts in cents"""
+    return round_cents(np.asarray(amount, dtype=float) * 100, rounding)
+
+
+def from_cents(amount):
+    """converts int64 amounts in cents to float amounts in euros"""
+    return np.asarray(amount) / 100
+
+
+def write_atomic(path, write):
+    """
+    writes a file in one step, so a killed process never leaves a partial file
+
+    :param path: the path of the file
+    :param write: function that writes the content to an open binary file
+
+    The content is written to path + '.tmp', synced to disk and then moved
+    to path with os.replace.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        write(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,379 @@
+"""
+Differential validation of the payment engines against the reference runner
+
+The reference semantics are those of generate_payments and the
+MortgageLoanRunner:
+
+- a loanpart pays during npers periods. generate_payments yields one extra
+  item after the last payment, which the runner never consumes as its
+  loanparts stop when no periods remain, so engines produce npers periods.
+- the fixed amount is paid each period and is counted as interest.
+- a rate change replaces the loanpart with new_loanpart_with_rate, which
+  recomputes the payment from the current amount and the remaining periods.
+
+validate_engines generates random mortgages with rate changes, runs the
+reference runner and every engine, and reports the maximum deviation and the
+speedup of each engine. The cents engine is compared with
+reference_cents_payments, which rounds to cents period by period, and the
+tolerance of float32 storage scales with the amounts. When an engine deviates
+more than its tolerance, the worst mortgage is shrunk to a minimal failing
+example:
+
+    report = validate_engines(n_loans=500, seed=1)
+    print(report.to_dataframe())
+"""
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .batch import PAYMENT_COLUMNS, YEAR_COLUMNS, batch_payments, batch_schedule, \
+    batch_schedule_chunked, sum_loanparts
+from .core import LoanPartIterator, MortgageLoanRunner, group_by_year
+from .utils import from_cents, get_annuity_payment, round_cents, to_cents
+
+CASE_COLUMNS = ('amount', 'rate', 'npers', 'fv', 'fixed', 'change_period', 'new_rate')
+START_YEAR_MONTH = '2020-10'
+
+
+def random_cases(n_loans, n_parts=2, max_periods=360, seed=None):
+    """
+    generates random mortgages of loanparts with a rate change
+
+    :return: dictionary with arrays of shape (n_loans, n_parts) for the columns
+    in CASE_COLUMNS. Rates are monthly rates. A change_period of npers or
+    more means the rate does not change.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (n_loans, n_parts)
+    amount = np.round(rng.uniform(1000., 500000., shape), 2)
+    npers = rng.integers(1, max_periods + 1, shape)
+    kind = rng.integers(3, size=shape)
+    fv = np.where(kind == 0, 0., np.where(kind == 1, amount,
+                                          np.round(amount * rng.uniform(size=shape), 2)))
+    fixed = np.where(rng.uniform(size=shape) < 0.3,
+                     np.round(rng.uniform(0, 10, shape), 2), 0.)
+    change_period = np.where(rng.uniform(size=shape) < 0.5,
+                             rng.integers(0, max_periods, shape), max_periods)
+    return {'amount': amount, 'rate': rng.choice([0., 0.001, 0.003, 0.006], shape),
+            'npers': npers, 'fv': fv, 'fixed': fixed, 'change_period': change_period,
+            'new_rate': rng.uniform(0., 0.008, shape)}
+
+
+def _select(cases, rows):
+    return {column: values[rows] for column, values in cases.items()}
+
+
+def _period_rates(cases, n_periods):
+    """rates per period with the rate changes, (n_loans, n_parts, n_periods)"""
+    periods = np.arange(n_periods)
+    return np.where(periods < cases['change_period'][..., None],
+                    cases['rate'][..., None], cases['new_rate'][..., None])
+
+
+def reference_payments(case):
+    """
+    runs a single mortgage in the MortgageLoanRunner
+
+    :param case: dictionary with arrays of shape (n_parts,)
+    :return: the dataframe of the runner
+    """
+    runner = MortgageLoanRunner()
+    for i in range(len(case['amount'])):
+        runner.add_loanpart(LoanPartIterator(
+            case['amount'][i], case['rate'][i], int(case['npers'][i]),
+            case['fv'][i], case['fixed'][i]))
+    while True:
+        for i, loanpart in enumerate(runner.loanparts):
+            if runner.period == case['change_period'][i] \
+                    and loanpart.remaining_periods > 0:
+                runner.replace_loanpart_by_index(
+                    loanpart.new_loanpart_with_rate(case['new_rate'][i]), i)
+        try:
+            runner.step()
+        except StopIteration:
+            break
+    return runner.to_dataframe()
+
+
+def reference_cents_payments(case, rounding='half_up'):
+    """
+    runs a single mortgage period by period in whole cents
+
+    :param case: dictionary with arrays of shape (n_parts,)
+    :return: dataframe in euros with the columns of MortgageLoanRunner.to_dataframe
+
+    Each loanpart follows the reference runner, with the rounding rules of the
+    cents mode of batch_schedule applied period by period: the payment is
+    rounded to cents whenever it is (re)computed, the interest is rounded to
+    cents every period and the last repayment closes the loan.
+    """
+    n_periods = int(case['npers'].max())
+    totals = np.zeros((n_periods, 3), dtype=np.int64)
+    for i in range(len(case['amount'])):
+        balance = int(to_cents(case['amount'][i], rounding))
+        fv = int(to_cents(case['fv'][i], rounding))
+        fixed = int(to_cents(case['fixed'][i], rounding))
+        npers = int(case['npers'][i])
+        rate = payment = None
+        for period in range(npers):
+            period_rate = case['rate'][i] if period < case['change_period'][i] \
+                else case['new_rate'][i]
+            if period_rate != rate:
+                rate = period_rate
+                payment = int(round_cents(get_annuity_payment(
+                    rate, npers - period, balance, fv), rounding)) + fixed
+            interest = int(round_cents(balance * rate, rounding)) + fixed
+            repayment = balance - fv if period == npers - 1 else payment - interest
+            totals[period] += (balance, interest, repayment)
+            balance -= repayment
+    amount, interest, repayment = from_cents(totals).T
+    return pd.DataFrame({'amount': amount, 'payment': interest + repayment,
+                         'interest': interest, 'repayment': repayment,
+                         'amount_end': amount - repayment})[PAYMENT_COLUMNS]
+
+
+def _run_batch(cases, n_periods):
+    return sum_loanparts(batch_schedule(
+        cases['amount'], _period_rates(cases, n_periods), cases['npers'],
+        cases['fv'], cases['fixed']))
+
+
+def _run_cents(cases, n_periods):
+    payments = batch_schedule(cases['amount'], _period_rates(cases, n_periods),
+                              cases['npers'], cases['fv'], cases['fixed'], cents=True)
+    payments = sum_loanparts(payments)
+    return type(payments)(amount=from_cents(payments.amount),
+                          interest=from_cents(payments.interest),
+                          repayment=from_cents(payments.repayment))
+
+
+def _run_chunked_float32(cases, n_periods):
+    payments = batch_schedule_chunked(
+        cases['amount'], _period_rates(cases, n_periods), cases['npers'],
+        cases['fv'], cases['fixed'], chunk_size=64, storage_dtype=np.float32)
+    # the loanparts are summed in float64, so only the storage error is validated
+    return sum_loanparts(type(payments)(amount=payments.amount.astype(float),
+                                        interest=payments.interest.astype(float),
+                                        repayment=payments.repayment.astype(float)))
+
+
+def _run_yearly(cases, n_periods):
+    return sum_loanparts(batch_payments(
+        cases['amount'], cases['rate'], cases['npers'], cases['fv'], cases['fixed'],
+        granularity='year', start_year_month=START_YEAR_MONTH))
+
+
+@dataclass
+class Engine:
+    """
+    a payment engine under validation
+
+    run: function of the cases and the number of periods that returns the
+    totals per mortgage, PaymentData or YearlyPayments if yearly is True
+    tolerance: the maximum absolute deviation in euros
+    rtol: the maximum deviation relative to the largest amount of the
+    mortgage, added to the tolerance
+    reference: function of a single mortgage that returns the reference
+    dataframe, see reference_payments
+    rate_events: whether the engine supports rate changes, if not it is only
+    validated on the mortgages without rate changes
+    """
+
+    name: str
+    run: Callable
+    tolerance: float
+    rtol: float = 0.
+    rate_events: bool = True
+    yearly: bool = False
+    reference: Callable = reference_payments
+
+    def allowed_deviation(self, reference):
+        """the allowed deviation from a reference dataframe"""
+        return self.tolerance + self.rtol * float(np.max(np.abs(reference['amount'])))
+
+
+DEFAULT_ENGINES = (
+    Engine('batch', _run_batch, 1e-6),
+    # the cents engine is exact against the reference rounded per period
+    Engine('cents', _run_cents, 1e-6, reference=reference_cents_payments),
+    # float32 keeps about 7 digits, a few roundings per loanpart
+    Engine('chunked_float32', _run_chunked_float32, 1e-6, rtol=5e-7),
+    Engine('yearly', _run_yearly, 1e-6, rate_events=False, yearly=True),
+)
+
+
+def _values(result, row, yearly):
+    """the columns of a mortgage in the result of an engine, (n_rows, n_columns)"""
+    if yearly:
+        has_payments = result.months[row] > 0
+        return np.stack([getattr(result, column)[row, has_payments]
+                         for column in YEAR_COLUMNS], axis=-1)
+    return np.stack([getattr(result, column)[row] for column in PAYMENT_COLUMNS],
+                    axis=-1).astype(float)
+
+
+def _deviation(values, reference):
+    """the maximum absolute deviation, periods missing in one of both count fully"""
+    n_rows = max(len(values), len(reference))
+    padded = [np.pad(x, ((0, n_rows - len(x)), (0, 0))) for x in (values, reference)]
+    return float(np.max(np.abs(padded[0] - padded[1]), initial=0.))
+
+
+def _reference_values(df, yearly):
+    if yearly:
+        return group_by_year(df, START_YEAR_MONTH)[YEAR_COLUMNS].values
+    return df[PAYMENT_COLUMNS].values
+
+
+def _case_fails(engine, case):
+    """whether the deviation of an engine for a single mortgage is too large"""
+    cases = {column: values[None] for column, values in case.items()}
+    result = engine.run(cases, int(case['npers'].max()))
+    reference = engine.reference(case)
+    deviation = _deviation(_values(result, 0, engine.yearly),
+                           _reference_values(reference, engine.yearly))
+    return deviation > engine.allowed_deviation(reference)
+
+
+def shrink_case(case, fails):
+    """
+    reduces a failing mortgage to a minimal example that still fails
+
+    :param case: dictionary with arrays of shape (n_parts,)
+    :param fails: function of a case that returns True if it fails
+    :return: the smallest failing case found
+
+    Simplifications are tried one at a time and kept if the case still
+    fails: dropping loanparts, removing rate changes, zero fixed amounts and
+    future values, fewer periods and round amounts.
+    """
+    def _candidates(case):
+        n_parts = len(case['amount'])
+        if n_parts > 1:
+            for i in range(n_parts):
+                yield {column: np.delete(values, i) for column, values in case.items()}
+        for column, value in (('change_period', case['npers']), ('fixed', 0.),
+                              ('fv', 0.), ('amount', np.round(case['amount'], -3)),
+                              ('new_rate', np.round(case['new_rate'], 4))):
+            value = np.maximum(np.broadcast_to(value, case[column].shape), 0)
+            candidate = dict(case, **{column: value.astype(case[column].dtype)})
+            if column == 'amount':
+                candidate['amount'] = np.maximum(candidate['amount'], 1000.)
+                candidate['fv'] = np.minimum(candidate['fv'], candidate['amount'])
+            yield candidate
+        npers = np.maximum(case['npers'] // 2, 1)
+        yield dict(case, npers=npers,
+                   change_period=np.minimum(case['change_period'], npers))
+
+    shrinking = True
+    while shrinking:
+        shrinking = False
+        for candidate in _candidates(case):
+            changed = any(not np.array_equal(candidate[column], case[column])
+                          for column in case)
+            if changed and fails(candidate):
+                case, shrinking = candidate, True
+                break
+    return case
+
+
+@dataclass
+class EngineResult:
+    """the validation result of a single engine"""
+
+    name: str
+    n_loans: int
+    max_deviation: float
+    tolerance: float
+    rtol: float
+    n_failed: int
+    seconds: float
+    speedup: float
+    failing_case: Optional[dict] = None
+
+    @property
+    def passed(self):
+        return self.n_failed == 0
+
+
+@dataclass
+class ValidationReport:
+    """dataclass with the results of validate_engines"""
+
+    reference_seconds: float
+    results: List[EngineResult] = field(default_factory=list)
+
+    @property
+    def passed(self):
+        return all(result.passed for result in self.results)
+
+    def to_dataframe(self):
+        return pd.DataFrame([
+            {'engine': result.name, 'n_loans': result.n_loans,
+             'max_deviation': result.max_deviation, 'tolerance': result.tolerance,
+             'rtol': result.rtol, 'n_failed': result.n_failed, 'passed': result.passed,
+             'seconds': result.seconds, 'speedup': result.speedup}
+            for result in self.results]).set_index('engine')
+
+
+def validate_engines(n_loans=200, n_parts=2, max_periods=360, seed=None,
+                     engines=DEFAULT_ENGINES, shrink=True):
+    """
+    compares engines with the reference runner on random mortgages
+
+    :param n_loans: the number of random mortgages
+    :param n_parts: the number of loanparts per mortgage
+    :param max_periods: the maximum number of periods of a loanpart
+    :param seed: seed of the random mortgages
+    :param engines: the engines to validate, see Engine
+    :param shrink: whether to shrink the worst mortgage of failing engines
+    :return: ValidationReport
+
+    The speedup is the time of the reference runner for the mortgages an
+    engine is validated on divided by the time of the engine. Engines with
+    another reference, like the cents engine, are compared with it but the
+    speedup is still against the reference runner.
+    """
+    cases = random_cases(n_loans, n_parts, max_periods, seed)
+    started = time.perf_counter()
+    references, seconds = {reference_payments: []}, []
+    for row in range(n_loans):
+        references[reference_payments].append(reference_payments(_select(cases, row)))
+        seconds.append(time.perf_counter() - started)
+    seconds = np.diff(seconds, prepend=0.)
+    report = ValidationReport(reference_seconds=float(seconds.sum()))
+
+    no_events = np.all(cases['change_period'] >= cases['npers'], axis=1)
+    for engine in engines:
+        rows = np.arange(n_loans) if engine.rate_events else np.flatnonzero(no_events)
+        if len(rows) == 0:
+            continue
+        selected = _select(cases, rows)
+        started = time.perf_counter()
+        result = engine.run(selected, int(selected['npers'].max()))
+        engine_seconds = time.perf_counter() - started
+
+        if engine.reference not in references:
+            references[engine.reference] = [
+                engine.reference(_select(cases, row)) for row in range(n_loans)]
+        engine_references = [references[engine.reference][row] for row in rows]
+        deviations = np.array([
+            _deviation(_values(result, i, engine.yearly),
+                       _reference_values(reference, engine.yearly))
+            for i, reference in enumerate(engine_references)])
+        allowed = np.array([engine.allowed_deviation(reference)
+                            for reference in engine_references])
+        engine_result = EngineResult(
+            name=engine.name, n_loans=len(rows), max_deviation=float(deviations.max()),
+            tolerance=engine.tolerance, rtol=engine.rtol,
+            n_failed=int(np.sum(deviations > allowed)), seconds=engine_seconds,
+            speedup=float(seconds[rows].sum()) / engine_seconds)
+        if not engine_result.passed and shrink:
+            engine_result.failing_case = shrink_case(
+                _select(cases, rows[np.argmax(deviations / allowed)]),
+                lambda case: _case_fails(engine, case))
+        report.results.append(engine_result)
+    return report
@@ -0,0 +1,284 @@
+"""
+tests for the vectorized payment engine in mortgage_scenarios.batch
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from mortgage_scenarios import MortgageLoanRunner, LoanPartIterator
+from mortgage_scenarios.batch import batch_payments, batch_schedule, \
+    batch_to_dataframe, sum_loanparts, batch_group_by_year, batch_schedule_chunked, \
+    get_chunk_size, tune_chunk_size, PAYMENT_COLUMNS
+from mortgage_scenarios.core import PaymentData
+from mortgage_scenarios.core import group_by_year
+
+loanpart_parameters = {
+    'annuity': (100000., 0.003, 360, 0., 0.),
+    'interest_only': (50000., 0.002, 120, 50000., 0.),
+    'fixed': (25000., 0.0025, 240, 0., 2.5),
+}
+
+
+def _run_reference(*loanparts):
+    """runs the loanparts in a MortgageLoanRunner and returns its dataframe"""
+    runner = MortgageLoanRunner()
+    for loanpart in loanparts:
+        runner.add_loanpart(loanpart)
+    runner.step_all()
+    return runner.to_dataframe()
+
+
+@pytest.mark.parametrize('parameters', list(loanpart_parameters.values()),
+                         ids=list(loanpart_parameters.keys()))
+def test_batch_payments_equals_runner(parameters):
+    """a single loanpart gives the same output as the MortgageLoanRunner"""
+
+    # arrange
+    expected_df = _run_reference(LoanPartIterator(*parameters))
+
+    # act
+    df = batch_to_dataframe(batch_payments(*parameters))
+
+    # assert
+    pd.testing.assert_frame_equal(df, expected_df)
+
+
+def test_batch_payments_mortgage_of_loanparts():
+    """loanparts with different durations are summed like in the runner"""
+
+    # arrange
+    parameters = list(loanpart_parameters.values())
+    expected_df = _run_reference(*(LoanPartIterator(*p) for p in parameters))
+
+    # act
+    payments = batch_payments(*zip(*parameters))
+    df = batch_to_dataframe(sum_loanparts(payments))
+
+    # assert
+    assert payments.amount.shape == (3, 360)
+    pd.testing.assert_frame_equal(df, expected_df)
+
+
+def test_batch_schedule_rate_change():
+    """a rate change equals replacing the loanpart with new_loanpart_with_rate"""
+
+    # arrange
+    amount, rate, npers, new_rate, change_period = 100000., 0.003, 24, 0.004, 10
+    loanpart = LoanPartIterator(amount, rate, npers)
+    runner = MortgageLoanRunner()
+    runner.add_loanpart(loanpart)
+    for _ in range(change_period):
+        runner.step()
+    runner.replace_loanpart(loanpart, loanpart.new_loanpart_with_rate(new_rate))
+    runner.step_all()
+    rates = np.where(np.arange(npers) < change_period, rate, new_rate)
+
+    # act
+    df = batch_to_dataframe(batch_schedule(amount, rates, npers))
+
+    # assert
+    pd.testing.assert_frame_equal(df, runner.to_dataframe())
+
+
+def test_batch_payments_cents_closes_exactly():
+    """in cents mode the payments are whole cents and the loan ends at fv"""
+
+    # arrange
+    amounts = np.array([100000.01, 250000., 99999.99])
+    fv = np.array([0., 0., 50000.])
+
+    # act
+    payments = batch_payments(amounts, 0.0031, 360, fv=fv, cents=True)
+
+    # assert
+    assert payments.amount.dtype == np.int64
+    assert np.all(payments.repayment.sum(axis=-1) == np.round((amounts - fv) * 100))
+    assert np.all(payments.amount_end[:, -1] == fv * 100)
+    # the rounded payment is constant, except for the closing payment
+    assert np.all(payments.payment[:, :-1] == payments.payment[:, :1])
+
+
+def test_batch_payments_cents_close_to_float():
+    """cents mode deviates less than a cent per period from the float mode"""
+
+    # act
+    payments_float = batch_payments(200000., 0.0025, 360)
+    payments_cents = batch_payments(200000., 0.0025, 360, cents=True)
+
+    # assert
+    deviation = np.abs(payments_cents.interest / 100 - payments_float.interest)
+    assert deviation.max() < 0.01 * 360
+
+
+def test_batch_payments_invalid_periods():
+    """npers should be positive, like in generate_payments"""
+
+    with pytest.raises(ValueError):
+        batch_payments(1000., 0.01, [12, 0])
+
+
+def test_batch_group_by_year_equals_group_by_year():
+    """yearly aggregation equals group_by_year on the runner output"""
+
+    # arrange
+    parameters = loanpart_parameters['fixed']
+    expected_df = group_by_year(_run_reference(LoanPartIterator(*parameters)),
+                                '2020-10')
+
+    # act
+    yearly = batch_group_by_year(batch_payments(*parameters), '2020-10')
+
+    # assert
+    pd.testing.assert_frame_equal(yearly.to_dataframe(), expected_df)
+
+
+def test_batch_group_by_year_months_after_end():
+    """months after a loan has finished are not counted"""
+
+    # act
+    yearly = batch_group_by_year(batch_payments(1000., 0.01, [6, 18]), '2020-10')
+
+    # assert
+    assert yearly.months.tolist() == [[3, 3, 0], [3, 12, 3]]
+    assert yearly.amount_end[0, 1] == pytest.approx(0, abs=1e-9)
+
+
+def test_batch_payments_granularity_year_equals_group_by_year():
+    """the closed-form yearly aggregates equal group_by_year of the runner"""
+
+    # arrange
+    parameters = list(loanpart_parameters.values())
+    expected_df = group_by_year(
+        _run_reference(*(LoanPartIterator(*p) for p in parameters)), '2020-10')
+
+    # act
+    yearly = batch_payments(*zip(*parameters), granularity='year',
+                            start_year_month='2020-10')
+    df = sum_loanparts(yearly).to_dataframe()
+
+    # assert
+    pd.testing.assert_frame_equal(df, expected_df, check_exact=False, atol=1e-6)
+
+
+def test_batch_payments_granularity_year_requires_start():
+    """the start month is needed to align the periods with calendar years"""
+
+    with pytest.raises(ValueError):
+        batch_payments(1000., 0.01, 12, granularity='year')
+
+
+@pytest.mark.parametrize('chunk_size', [None, 1, 7])
+def test_batch_schedule_chunked_equals_batch_schedule(chunk_size):
+    """chunked execution on threads gives the same result as a single batch"""
+
+    # arrange
+    amounts = np.linspace(10000., 300000., 50)
+    npers = np.arange(50) + 100
+    rates = np.full((50, 1), 0.003)
+    expected = batch_schedule(amounts, rates, npers, fixed=1.)
+
+    # act
+    payments = batch_schedule_chunked(amounts, rates, npers, fixed=1.,
+                                      chunk_size=chunk_size, max_workers=3)
+
+    # assert
+    np.testing.assert_array_equal(payments.amount, expected.amount)
+    np.testing.assert_array_equal(payments.interest, expected.interest)
+    np.testing.assert_array_equal(payments.repayment, expected.repayment)
+
+
+def test_batch_schedule_chunked_writes_into_out():
+    """the result is written into the preallocated output"""
+
+    # arrange
+    out = batch_payments(np.zeros(4), 0., 12)
+
+    # act
+    payments = batch_schedule_chunked(np.full(4, 1200.), [[0.]], 12, chunk_size=3,
+                                      out=out)
+
+    # assert
+    assert payments is out
+    assert np.all(out.repayment == 100.)
+
+
+def test_get_chunk_size_fits_budget():
+    """a chunk of 360 periods fits in the memory budget"""
+
+    chunk_size = get_chunk_size(360, memory_budget=2 ** 20)
+    assert 0 < chunk_size * 360 * 3 * 8 <= 2 ** 20
+
+
+def test_tune_chunk_size_returns_candidate():
+    """the tuned chunk size is one of the candidates"""
+
+    # act
+    chunk_size = tune_chunk_size(np.linspace(1e5, 2e5, 50), [[0.003]], 120,
+                                 candidates=[5, 20], max_workers=2,
+                                 sample_rows=40, repeats=1)
+
+    # assert
+    assert chunk_size in (5, 20)
+
+
+def test_batch_schedule_chunked_loanpart_axis():
+    """chunks of mortgages with several loanparts are written into out"""
+
+    # arrange
+    rng = np.random.default_rng(1)
+    amount = rng.uniform(10000., 500000., (103, 2))
+    npers = rng.integers(12, 120, (103, 2))
+    expected = batch_schedule(amount, [[0.003]], npers)
+    out = PaymentData(amount=np.zeros((103, 2, 119)), interest=np.zeros((103, 2, 119)),
+                      repayment=np.zeros((103, 2, 119)))
+
+    # act
+    result = batch_schedule_chunked(amount, [[0.003]], npers, chunk_size=10,
+                                    max_workers=3, out=out)
+
+    # assert
+    assert result is out
+    for column in PAYMENT_COLUMNS:
+        np.testing.assert_array_equal(getattr(result, column),
+                                      getattr(expected, column))
+
+
+def test_batch_schedule_float32_storage_reports_errors():
+    """float32 storage halves the memory and reports the errors per column"""
+
+    # arrange
+    amounts = np.linspace(100000., 900000., 20)
+    expected = batch_payments(amounts, 0.003, 360)
+    errors = {}
+
+    # act
+    payments = batch_schedule(amounts, [[0.003]], 360, storage_dtype=np.float32,
+                              errors=errors)
+
+    # assert
+    assert payments.amount.dtype == np.float32
+    assert set(errors) == set(PAYMENT_COLUMNS)
+    for column in PAYMENT_COLUMNS:
+        actual_error = np.abs(getattr(payments, column).astype(float)
+                              - getattr(expected, column)).max()
+        assert errors[column] == pytest.approx(actual_error)
+        assert errors[column] < 0.1
+
+
+def test_batch_schedule_chunked_float32_errors():
+    """the errors of all chunks are combined"""
+
+    # arrange
+    amounts = np.linspace(100000., 900000., 20)
+    expected_errors = {}
+    batch_schedule(amounts, [[0.003]], 360, storage_dtype=np.float32,
+                   errors=expected_errors)
+    errors = {}
+
+    # act
+    payments = batch_schedule_chunked(amounts, [[0.003]], 360, chunk_size=6,
+                                      storage_dtype=np.float32, errors=errors)
+
+    # assert
+    assert payments.repayment.dtype == np.float32
+    assert errors == expected_errors
@@ -0,0 +1,62 @@
+"""
+tests for the strategy comparison in mortgage_scenarios.comparison
+"""
+import numpy as np
+import pytest
+
+from mortgage_scenarios.batch import batch_payments
+from mortgage_scenarios.comparison import compare_strategies, refix_penalty, \
+    refix_rates
+
+
+def test_refix_penalty_zero_when_market_rate_higher():
+    """no penalty is due if the market rate is at or above the contract rate"""
+
+    # act
+    penalty = refix_penalty(100000., [0.003, 0.003], [0.003, 0.004], 60)
+
+    # assert
+    assert penalty == pytest.approx([0., 0.])
+
+
+def test_refix_penalty_interest_difference():
+    """with a zero market rate the penalty is the undiscounted difference"""
+
+    # act
+    penalty = refix_penalty(100000., 0.001, 0., 12, penalty_free_fraction=0.1)
+
+    # assert
+    assert penalty == pytest.approx(0.001 * 90000. * 12)
+
+
+def test_compare_strategies_npv_zero_discount():
+    """without discounting the npv is the sum of payments and penalties"""
+
+    # arrange
+    rates = np.stack([refix_rates(0.003, 0.003, 0, 120),
+                      refix_rates(0.003, 0.002, 0, 120)])
+    expected = [batch_payments(100000., 0.003, 120).payment.sum(),
+                batch_payments(100000., 0.002, 120).payment.sum() + 500.]
+
+    # act
+    comparison = compare_strategies(100000., 120, rates, [[0.]],
+                                    penalties=[0., 500.])
+
+    # assert
+    assert comparison.npv[:, 0] == pytest.approx(expected)
+
+
+def test_compare_strategies_break_even():
+    """the penalty is earned back in the period the savings exceed it"""
+
+    # arrange: interest-only loans, so the saving is 10 each period
+    rates = np.array([[0.002], [0.0019]])
+
+    # act
+    comparison = compare_strategies([100000., 100000.], 120, rates, [[0.]],
+                                    fv=100000., penalties=[[0., 0.], [95., 500.]])
+
+    # assert
+    assert comparison.npv.shape == (2, 1, 2)
+    assert comparison.break_even[1, 0].tolist() == [9, 49]
+    assert comparison.cumulative_difference[1, 0, 0, -1] == pytest.approx(95 - 1200)
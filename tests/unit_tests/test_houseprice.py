@@ -0,0 +1,121 @@
+"""
+tests for the house price paths and LTV pricing in mortgage_scenarios.houseprice
+"""
+from bisect import bisect
+
+import numpy as np
+import pytest
+
+from mortgage_scenarios import MortgageLoanRunner, LoanPartIterator, get_monthly_rate
+from mortgage_scenarios.batch import batch_schedule
+from mortgage_scenarios.houseprice import LTV_BOUNDARIES, get_ltv_band, growth_path, \
+    ltv_priced_schedule, simulate_market_paths
+
+spreads = np.array([-0.002, 0., 0.001, 0.003])
+
+
+def test_get_ltv_band_equals_bisect():
+    """the bands equal bisect on the boundaries, also on the boundaries"""
+
+    ltv = np.array([0.5, 0.675, 0.8, 0.9, 0.95, 1.0, 1.2])
+    assert get_ltv_band(ltv).tolist() == [bisect(LTV_BOUNDARIES, x) for x in ltv]
+
+
+def test_growth_path():
+    """the house value grows with the monthly rate of the yearly growth"""
+
+    values = growth_path(np.array([100000., 200000.]), 25, 0.03)
+    assert values.shape == (2, 25)
+    assert values[:, 0].tolist() == [100000., 200000.]
+    assert values[0, 12] == pytest.approx(103000.)
+
+
+def test_simulate_market_paths_correlation():
+    """the house price returns are correlated with the rate changes"""
+
+    # act
+    paths = simulate_market_paths(2000, 61, 0.03, correlation=-0.5, seed=1)
+
+    # assert
+    assert paths.price_index.shape == paths.rates.shape == (2000, 61)
+    assert np.all(paths.price_index[:, 0] == 1.) and np.all(paths.rates[:, 0] == 0.03)
+    correlation = np.corrcoef(np.diff(np.log(paths.price_index)).ravel(),
+                              np.diff(paths.rates).ravel())[0, 1]
+    assert correlation == pytest.approx(-0.5, abs=0.03)
+
+
+def test_ltv_priced_schedule_equals_runner():
+    """repricing on band changes equals replacing the loanparts in the runner"""
+
+    # arrange
+    amounts, fv, npers = [92500., 198183., 144000.], [92500., 0., 0.], 360
+    base = np.array([0.0215, 0.0195, 0.0195])
+    house_value = growth_path(500000., npers, 0.02)
+    band = get_ltv_band(sum(amounts) / house_value[0])
+    runner = MortgageLoanRunner()
+    for amount, rate, future in zip(amounts, base, fv):
+        runner.add_loanpart(LoanPartIterator(
+            amount, get_monthly_rate(rate + spreads[band]), npers, future))
+    for period in range(npers):
+        new_band = get_ltv_band(runner.current_amount / house_value[period])
+        if new_band != band:
+            band = new_band
+            for i, loanpart in enumerate(runner.loanparts):
+                runner.replace_loanpart_by_index(loanpart.new_loanpart_with_rate(
+                    get_monthly_rate(base[i] + spreads[band])), i)
+        runner.step()
+    expected = runner.to_dataframe()
+
+    # act
+    payments = ltv_priced_schedule(amounts, base[:, None], npers, house_value, spreads,
+                                   fv=fv)
+
+    # assert
+    np.testing.assert_allclose(payments.interest.sum(axis=0), expected['interest'],
+                               rtol=1e-12)
+    np.testing.assert_allclose(payments.amount.sum(axis=0), expected['amount'],
+                               rtol=1e-12)
+
+
+def test_ltv_priced_schedule_paths():
+    """mortgages are priced on every house price path at once"""
+
+    # arrange
+    amounts = np.array([[150000., 100000.], [300000., 0.]])[:, None, :]
+    paths = simulate_market_paths(5, 120, 0.03, price_drift=0.05, seed=2)
+    house_value = paths.house_values([300000., 350000.], loanparts=True)
+
+    # act
+    payments = ltv_priced_schedule(amounts, [[0.03]], 120, house_value, spreads)
+
+    # assert
+    assert payments.amount.shape == (2, 5, 2, 120)
+    # without LTV changes the spread of the first band applies throughout
+    flat = ltv_priced_schedule(amounts, [[0.03]], 120, np.full((1, 1, 1, 1), 1e9),
+                               spreads)
+    expected = batch_schedule(amounts, [[get_monthly_rate(0.028)]], 120)
+    np.testing.assert_allclose(flat.interest[:, 0], expected.interest[:, 0])
+
+
+def test_ltv_priced_schedule_path_rates():
+    """mortgages are priced on the joint house price and rate paths"""
+
+    # arrange: as many paths as loanparts
+    amounts = np.array([[150000., 100000.], [300000., 0.]])[:, None, :]
+    paths = simulate_market_paths(2, 120, 0.03, price_drift=0.05, correlation=-0.5,
+                                  seed=3)
+    house_values = [300000., 350000.]
+
+    # act
+    payments = ltv_priced_schedule(amounts, paths.path_rates(loanparts=True), 120,
+                                   paths.house_values(house_values, loanparts=True),
+                                   spreads)
+
+    # assert: each path equals pricing on its own rate and house price path
+    assert payments.amount.shape == (2, 2, 2, 120)
+    for path in range(2):
+        expected = ltv_priced_schedule(
+            amounts[:, 0], paths.rates[path], 120,
+            np.asarray(house_values)[:, None, None] * paths.price_index[path], spreads)
+        np.testing.assert_array_equal(payments.interest[:, path], expected.interest)
+        np.testing.assert_array_equal(payments.amount[:, path], expected.amount)
@@ -0,0 +1,49 @@
+"""
+tests for the refix timing optimizer in mortgage_scenarios.refix
+"""
+import numpy as np
+import pytest
+
+from mortgage_scenarios.batch import batch_schedule
+from mortgage_scenarios.refix import optimize_refix
+
+
+@pytest.fixture
+def market_rates():
+    """random walk of market rates for a 60 and a 120 period term"""
+    rng = np.random.default_rng(20201001)
+    level = 0.0025 + rng.normal(0, 0.00003, (200, 240)).cumsum(axis=1)
+    return np.clip(level, 0.0005, None)[..., None] + np.array([0., 0.0002])
+
+
+def test_optimize_refix_cost_equals_batch_engine(market_rates):
+    """the closed-form block costs equal the discounted batch engine payments"""
+
+    # arrange: the fixed period ends now and only the 60 period term exists
+    rates_60 = market_rates[..., :1]
+    block_starts = np.arange(240) // 60 * 60
+    path_rates = market_rates[:, block_starts, 0]
+    payments = batch_schedule(100000., path_rates, 240, fixed=5.)
+    discount = np.cumprod(np.full(240, 1 / 1.002))
+    expected = (payments.payment * discount).sum(axis=-1).mean()
+
+    # act
+    policy = optimize_refix(100000., 240, 0.003, 0, rates_60, [60],
+                            discount_rates=0.002, fixed=5.)
+
+    # assert
+    assert policy.expected_cost[0] == pytest.approx(expected)
+
+
+def test_optimize_refix_high_and_low_contract_rate(market_rates):
+    """a high contract rate is refixed at once, a low one waits until expiry"""
+
+    # act
+    policy = optimize_refix([100000., 100000.], 240, [0.006, 0.001], 60,
+                            market_rates, [60, 120], discount_rates=0.0025)
+
+    # assert
+    assert np.mean(policy.refix_period[0] == 0) > 0.8
+    assert np.all(policy.refix_period[1] == 60)
+    assert policy.expected_cost[0] < policy.expected_cost_at_expiry[0]
+    assert policy.refix_probability[1, -1] == pytest.approx(1.)
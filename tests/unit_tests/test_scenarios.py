@@ -0,0 +1,146 @@
+"""
+tests for state snapshots and the scenario tree executor
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from mortgage_scenarios import MortgageLoanRunner, LoanPartIterator
+from mortgage_scenarios.core import MortgageScenarioRunner
+from mortgage_scenarios.scenarios import ScenarioNode, run_scenario_tree
+
+
+@pytest.fixture
+def mortgage():
+    """mortgage with an annuity and an interest-only loanpart"""
+    runner = MortgageLoanRunner()
+    runner.add_loanpart(LoanPartIterator(100000., 0.003, 36, fixed=1.))
+    runner.add_loanpart(LoanPartIterator(50000., 0.002, 24, future=50000.))
+    return runner
+
+
+def test_snapshot_fork_leaves_original(mortgage):
+    """forking a snapshot with other rates does not change the snapshot"""
+
+    # arrange
+    mortgage.step()
+    state = mortgage.snapshot()
+
+    # act
+    fork = state.with_rates([0.004, None])
+
+    # assert
+    assert state.loanparts[0].rate == 0.003
+    assert fork.loanparts[0].rate == 0.004
+    assert fork.loanparts[1] == state.loanparts[1]
+    assert state.period == 1
+
+
+def test_runner_from_state_continues(mortgage):
+    """a runner created from a snapshot continues with the same payments"""
+
+    # arrange
+    for _ in range(10):
+        mortgage.step()
+    runner = MortgageLoanRunner.from_state(mortgage.snapshot())
+
+    # act
+    mortgage.step_all()
+    runner.step_all()
+
+    # assert
+    expected_df = mortgage.to_dataframe().loc[10:]
+    pd.testing.assert_frame_equal(runner.to_dataframe(), expected_df)
+
+
+def test_loanpart_from_state_keeps_period(mortgage):
+    """a snapshot of a restored loanpart continues from the snapshot period"""
+
+    # arrange
+    for _ in range(10):
+        mortgage.step()
+    state = mortgage.snapshot().loanparts[0]
+
+    # act
+    loanpart = LoanPartIterator.from_state(state)
+    next(loanpart)
+
+    # assert
+    assert loanpart.snapshot().period == 11
+    assert loanpart.snapshot().remaining_periods == 25
+
+
+def test_new_loanpart_with_rate_keeps_period(mortgage):
+    """replacing a loanpart with a new rate keeps the period of its snapshots"""
+
+    # arrange
+    for _ in range(10):
+        mortgage.step()
+    loanpart = mortgage.loanparts[0]
+
+    # act
+    mortgage.replace_loanpart(loanpart, loanpart.new_loanpart_with_rate(0.004))
+    mortgage.step()
+
+    # assert
+    assert mortgage.snapshot().loanparts[0].period == 11
+    assert mortgage.snapshot().loanparts[0].remaining_periods == 25
+
+
+def test_run_scenario_tree_array_rates(mortgage):
+    """an array of rates sets one rate per loanpart"""
+
+    # arrange
+    state = mortgage.snapshot()
+    root = ScenarioNode('base', periods=12)
+    root.add_child('up', rates=np.array([0.004, 0.003]))
+    fork = state.with_rates(np.array([0.004, 0.003]))
+
+    # act
+    results = run_scenario_tree(state, root)
+
+    # assert
+    assert [loanpart.rate for loanpart in fork.loanparts] == [0.004, 0.003]
+    assert len(results['base/up']) == 36
+
+
+def test_scenario_node_without_periods():
+    """segments should have at least one period"""
+
+    with pytest.raises(ValueError):
+        ScenarioNode('empty', periods=0)
+
+
+def test_scenario_runner_accepts_mortgage(mortgage):
+    """MortgageScenarioRunner stores a snapshot instead of copying generators"""
+
+    # act
+    scenario_runner = MortgageScenarioRunner(mortgage)
+
+    # assert
+    assert scenario_runner._mortgage_state == mortgage.snapshot()
+
+
+def test_run_scenario_tree_equals_runner(mortgage):
+    """each leaf equals a runner in which the rates change at the branch"""
+
+    # arrange
+    state = mortgage.snapshot()
+    root = ScenarioNode('base', periods=12)
+    for rate in (0.002, 0.004):
+        root.add_child(str(rate), rates=rate)
+
+    # act
+    results = run_scenario_tree(state, root)
+
+    # assert
+    assert list(results) == ['base/0.002', 'base/0.004']
+    for rate in (0.002, 0.004):
+        runner = MortgageLoanRunner.from_state(state)
+        for _ in range(12):
+            runner.step()
+        for loanpart in runner.loanparts[:]:
+            runner.replace_loanpart(loanpart, loanpart.new_loanpart_with_rate(rate))
+        runner.step_all()
+        pd.testing.assert_frame_equal(results['base/{}'.format(rate)],
+                                      runner.to_dataframe())
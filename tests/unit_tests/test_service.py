@@ -0,0 +1,132 @@
+"""
+tests for the micro-batching scenario service
+"""
+import asyncio
+import json
+
+import pandas as pd
+import pytest
+
+from mortgage_scenarios import MortgageLoanRunner, LoanPartIterator
+from mortgage_scenarios.core import group_by_year
+from mortgage_scenarios.service import MicroBatcher, evaluate_scenarios, start_server
+
+request_loanparts = [{'amount': 100000., 'rate': 0.003, 'periods': 120},
+                     {'amount': 50000., 'rate': 0.002, 'periods': 60,
+                      'future': 50000., 'fixed': 1.}]
+
+
+def _reference_dataframe():
+    runner = MortgageLoanRunner()
+    runner.add_loanpart(LoanPartIterator(100000., 0.003, 120))
+    runner.add_loanpart(LoanPartIterator(50000., 0.002, 60, 50000., 1.))
+    runner.step_all()
+    return runner.to_dataframe()
+
+
+def test_evaluate_scenarios_monthly_and_yearly():
+    """a batch with monthly and yearly requests equals the runner output"""
+
+    # arrange
+    requests = [{'loanparts': request_loanparts},
+                {'loanparts': request_loanparts[:1]},
+                {'loanparts': request_loanparts, 'start_year_month': '2020-10'}]
+    expected_df = _reference_dataframe()
+
+    # act
+    results = evaluate_scenarios(requests)
+
+    # assert
+    df = pd.DataFrame(results[0]).set_index('period')
+    pd.testing.assert_frame_equal(df, expected_df, check_names=False)
+    assert len(results[1]['period']) == 120
+    yearly_df = pd.DataFrame(results[2]).set_index('year')
+    pd.testing.assert_frame_equal(yearly_df, group_by_year(expected_df, '2020-10'),
+                                  check_names=False, check_exact=False, atol=1e-6)
+
+
+def test_micro_batcher_coalesces_requests():
+    """requests submitted together are evaluated in a single batch"""
+
+    batch_sizes = []
+
+    def evaluate(requests):
+        batch_sizes.append(len(requests))
+        return [request * 2 for request in requests]
+
+    async def run():
+        batcher = MicroBatcher(evaluate, max_batch_size=8, max_wait=0.05)
+        await batcher.start()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+        metrics = batcher.metrics()
+        await batcher.stop()
+        return results, metrics
+
+    # act
+    results, metrics = asyncio.run(run())
+
+    # assert
+    assert results == [2 * i for i in range(10)]
+    assert batch_sizes == [8, 2]
+    assert metrics['requests'] == 10 and metrics['batches'] == 2
+
+
+def test_micro_batcher_invalid_request_fails_alone():
+    """an invalid request raises for its own caller only"""
+
+    async def run():
+        batcher = MicroBatcher(max_wait=0.05)
+        await batcher.start()
+        results = await asyncio.gather(
+            batcher.submit({'loanparts': request_loanparts}),
+            batcher.submit({'loanparts': [{'amount': 1.}]}),
+            return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    valid, invalid = asyncio.run(run())
+    assert len(valid['period']) == 120
+    assert isinstance(invalid, KeyError)
+
+
+def _http_request(raw):
+    """sends a raw HTTP request to a new server and returns the response"""
+
+    async def run():
+        server, batcher = await start_server(port=0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(raw)
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        await batcher.stop()
+        return response
+
+    return asyncio.run(run())
+
+
+def test_server_http_round_trip():
+    """a request posted over HTTP returns the evaluated scenario"""
+
+    body = json.dumps({'loanparts': request_loanparts}).encode()
+    response = _http_request(b'POST /evaluate HTTP/1.1\r\nContent-Length: %d\r\n\r\n'
+                             % len(body) + body)
+    header, _, body = response.partition(b'\r\n\r\n')
+    assert header.startswith(b'HTTP/1.1 200')
+    assert json.loads(body)['amount'][0] == pytest.approx(150000.)
+
+
+@pytest.mark.parametrize('raw', [
+    b'POST /evaluate HTTP/1.1\r\nContent-Length: 5\r\n\r\n[1,2]',
+    b'POST /evaluate HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}',
+    b'POST /evaluate HTTP/1.1\r\nContent-Length: abc\r\n\r\n{}',
+], ids=['list', 'no_loanparts', 'content_length'])
+def test_server_invalid_request_bad_request(raw):
+    """invalid requests get a 400 response"""
+
+    response = _http_request(raw)
+    header, _, body = response.partition(b'\r\n\r\n')
+    assert header.startswith(b'HTTP/1.1 400')
+    assert 'error' in json.loads(body)
@@ -0,0 +1,88 @@
+"""
+tests for the quantile sketches in mortgage_scenarios.sketches
+"""
+import numpy as np
+import pytest
+
+from mortgage_scenarios.batch import batch_payments
+from mortgage_scenarios.sketches import QuantileSketch, PaymentSketches
+
+
+def _rank_error(values, estimates, q):
+    """the largest deviation of the rank of the estimates from q, per quantile"""
+    ranks = (values[None] < estimates[:, None]).mean(axis=1)
+    return np.abs(ranks - np.asarray(q)[:, None]).max()
+
+
+def test_quantile_sketch_close_to_percentile():
+    """the estimated quantiles have a small rank error per period"""
+
+    # arrange
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(0., 1., (40000, 12))
+    sketch = QuantileSketch(12, k=256, seed=1)
+    q = [0.05, 0.5, 0.95]
+
+    # act
+    for chunk in np.array_split(values, 7):
+        sketch.update(chunk)
+    estimates = sketch.quantiles(q)
+
+    # assert
+    assert estimates.shape == (3, 12)
+    assert sketch.count == 40000
+    assert _rank_error(values, estimates, q) < 0.02
+    # the memory does not grow with the number of paths
+    assert sum(level.shape[1] for level in sketch.levels) < 40000 / 10
+
+
+def test_quantile_sketch_merge_and_serialize():
+    """sketches of workers are merged after a round trip through bytes"""
+
+    # arrange
+    rng = np.random.default_rng(2)
+    values = rng.normal(1000., 100., (20000, 5))
+    workers = [QuantileSketch(5, k=128, seed=i).update(part)
+               for i, part in enumerate(np.array_split(values, 4))]
+
+    # act
+    merged = QuantileSketch.from_bytes(workers[0].to_bytes())
+    for worker in workers[1:]:
+        merged.merge(QuantileSketch.from_bytes(worker.to_bytes()))
+
+    # assert
+    assert merged.count == 20000
+    assert _rank_error(values, merged.quantiles([0.05, 0.5, 0.95]),
+                       [0.05, 0.5, 0.95]) < 0.03
+
+
+def test_quantile_sketch_invalid():
+    """values should have the periods of the sketch, and merges as well"""
+
+    sketch = QuantileSketch(3)
+    with pytest.raises(ValueError):
+        sketch.quantiles(0.5)
+    with pytest.raises(ValueError):
+        sketch.update(np.zeros((2, 4)))
+    with pytest.raises(ValueError):
+        sketch.merge(QuantileSketch(4))
+
+
+def test_payment_sketches_from_batch_output():
+    """payment, balance and cumulative interest are sketched per period"""
+
+    # arrange
+    rng = np.random.default_rng(3)
+    payments = batch_payments(rng.uniform(100000., 400000., 5000), 0.003, 120)
+    sketches = PaymentSketches(120, seed=4)
+
+    # act
+    sketches.update(payments)
+    restored = PaymentSketches.from_bytes(sketches.to_bytes())
+    quantiles = restored.quantiles()
+
+    # assert
+    assert set(quantiles) == {'payment', 'amount', 'cumulative_interest'}
+    expected = np.percentile(np.cumsum(payments.interest, axis=-1), 50, axis=0)
+    np.testing.assert_allclose(quantiles['cumulative_interest'][1], expected,
+                               rtol=0.02)
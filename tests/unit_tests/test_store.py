@@ -0,0 +1,92 @@
+"""
+tests for the indexed result store in mortgage_scenarios.store
+"""
+import numpy as np
+import pytest
+
+from mortgage_scenarios.batch import batch_payments
+from mortgage_scenarios.store import ResultStore, summarize
+
+amounts = np.array([100000., 300000., 450000., 500000.])
+house_values = np.array([400000., 320000., 480000., 500000.])
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultStore(str(tmp_path))
+    store.add('base', batch_payments(amounts, 0.002, 360), house_value=house_values)
+    store.add('rates+2%', batch_payments(amounts, 0.0036, 360, fv=[0, 0, 0, 500000.]),
+              house_value=house_values)
+    return store
+
+
+def test_summarize():
+    """the summary statistics of an annuity and an interest-only mortgage"""
+
+    # arrange
+    payments = batch_payments([120000., 100000.], 0.01, 12, fv=[0., 100000.])
+
+    # act
+    summary = summarize(payments, house_value=np.array([120000., 100000.]))
+
+    # assert
+    assert summary['payoff_period'].tolist() == [11, -1]
+    assert summary['ltv_start'].tolist() == [1., 1.]
+    assert summary['ltv_crossing_period'].tolist() == [2, -1]
+    assert summary['total_interest'][1] == pytest.approx(12000.)
+    assert summary['max_payment'][1] == pytest.approx(1000.)
+
+
+def test_summarize_mixed_npers():
+    """the periods after the end of a shorter mortgage do not count"""
+
+    # arrange: the interest-only mortgage ends before the annuity
+    payments = batch_payments([120000., 100000.], 0.01, [24, 12], fv=[0., 100000.])
+
+    # act
+    summary = summarize(payments, house_value=np.array([120000., 100000.]))
+
+    # assert
+    assert summary['payoff_period'].tolist() == [23, -1]
+    assert summary['ltv_crossing_period'].tolist() == [3, -1]
+
+
+def test_result_store_query_prunes_by_index(store):
+    """only the matching mortgages are returned with their full results"""
+
+    # act
+    result = store.query('ltv_start > 0.9 and max_payment > 1700',
+                         scenarios=['rates+2%'])
+
+    # assert
+    assert result.summary['mortgage_id'].tolist() == [2, 3]
+    payments = result.payments['rates+2%']
+    assert payments.amount.shape == (2, 360)
+    np.testing.assert_array_equal(
+        payments.interest, batch_payments(amounts[2:], 0.0036, 360,
+                                          fv=[0, 500000.]).interest)
+
+
+def test_result_store_query_all_scenarios(store):
+    """queries search all scenarios unless given, also without matches"""
+
+    # act
+    result = store.query('payoff_period == -1')
+    empty = store.query('max_payment > 1e9')
+
+    # assert
+    assert store.scenarios() == ['base', 'rates+2%']
+    assert result.summary[['scenario', 'mortgage_id']].values.tolist() == \
+        [['rates+2%', 3]]
+    assert len(empty.summary) == 0 and empty.payments == {}
+
+
+def test_result_store_reopen(store):
+    """a new store on the same directory reads the stored scenarios"""
+
+    # act
+    reopened = ResultStore(store.directory)
+
+    # assert
+    assert reopened.summary('base').equals(store.summary('base'))
+    assert isinstance(reopened.load('base').amount, np.memmap)
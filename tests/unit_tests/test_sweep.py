@@ -0,0 +1,95 @@
+"""
+tests for the resumable sweep executor in mortgage_scenarios.sweep
+"""
+import json
+
+import numpy as np
+import pytest
+
+from mortgage_scenarios import __version__, sweep
+from mortgage_scenarios.batch import batch_schedule
+from mortgage_scenarios.sweep import run_sweep, load_sweep
+
+book = {'amount': np.linspace(50000., 400000., 25), 'npers': np.arange(25) + 24}
+scenarios = {'base': [[0.003]], 'rates+2%': np.full((1, 48), 0.0045)}
+
+
+def test_run_sweep_results_and_manifest(tmp_path):
+    """the stored results equal batch_schedule, the manifest lists all chunks"""
+
+    # act
+    status = run_sweep(str(tmp_path), book, scenarios, chunk_size=10)
+
+    # assert
+    assert status == {'computed': 6, 'skipped': 0}
+    manifest = json.loads((tmp_path / 'manifest.json').read_text())
+    assert manifest['version'] == __version__
+    assert sorted(manifest['scenarios']['base']['chunks']) == ['0', '1', '2']
+    expected = batch_schedule(book['amount'], [[0.0045]], book['npers'], n_periods=48)
+    payments = load_sweep(str(tmp_path), 'rates+2%')
+    np.testing.assert_array_equal(payments.amount, expected.amount)
+    np.testing.assert_array_equal(payments.interest, expected.interest)
+
+
+def test_run_sweep_skips_done_and_redoes_missing_or_stale(tmp_path):
+    """a rerun only computes deleted chunks and the chunks of changed rates"""
+
+    # arrange
+    run_sweep(str(tmp_path), book, scenarios, chunk_size=10)
+    (tmp_path / 'base' / 'chunk_00001.npz').unlink()
+
+    # act
+    status_missing = run_sweep(str(tmp_path), book, scenarios, chunk_size=10)
+    status_stale = run_sweep(str(tmp_path), book, {**scenarios, 'base': [[0.0031]]},
+                             chunk_size=10)
+
+    # assert
+    assert status_missing == {'computed': 1, 'skipped': 5}
+    assert status_stale == {'computed': 3, 'skipped': 3}
+
+
+def test_run_sweep_resumes_after_failure(tmp_path, monkeypatch):
+    """the chunks finished before a crash are kept, the others are redone"""
+
+    # arrange
+    calls = []
+
+    def failing_schedule(**kwargs):
+        calls.append(1)
+        if len(calls) == 3:
+            raise MemoryError('killed')
+        return batch_schedule(**kwargs)
+
+    monkeypatch.setattr(sweep, 'batch_schedule', failing_schedule)
+    with pytest.raises(MemoryError):
+        run_sweep(str(tmp_path), book, scenarios, chunk_size=10, max_workers=1)
+    with pytest.raises(ValueError):
+        load_sweep(str(tmp_path), 'rates+2%')
+    monkeypatch.undo()
+
+    # act
+    status = run_sweep(str(tmp_path), book, scenarios, chunk_size=10)
+
+    # assert
+    assert status == {'computed': 4, 'skipped': 2}
+    assert load_sweep(str(tmp_path), 'base').amount.shape == (25, 48)
+    assert not list(tmp_path.glob('*/*.tmp'))
+
+
+def test_run_sweep_rate_curve_as_long_as_book(tmp_path):
+    """a rate curve is used for all loans, per-loan rates are split in chunks"""
+
+    # arrange: as many loans as periods in the curve
+    amounts = np.linspace(50000., 400000., 48)
+    curve = np.linspace(0.002, 0.004, 48)
+    per_loan = np.linspace(0.002, 0.004, 48)[:, None]
+
+    # act
+    run_sweep(str(tmp_path), {'amount': amounts, 'npers': 48},
+              {'curve': curve, 'per_loan': per_loan}, chunk_size=10)
+
+    # assert
+    for scenario_id, rates in [('curve', curve), ('per_loan', per_loan)]:
+        expected = batch_schedule(amounts, rates, 48)
+        np.testing.assert_array_equal(load_sweep(str(tmp_path), scenario_id).amount,
+                                      expected.amount)
@@ -0,0 +1,93 @@
+"""
+tests for the precomputed annuity tables in mortgage_scenarios.tables
+"""
+import numpy as np
+import pytest
+
+from mortgage_scenarios.tables import AnnuityTable
+from mortgage_scenarios.utils import get_annuity_payment, get_balance_after, \
+    get_monthly_rate
+
+
+@pytest.fixture(scope='module')
+def table():
+    return AnnuityTable.build(range(0, 501), [10, 20, 30])
+
+
+def test_annuity_table_exact_on_grid(table):
+    """quoted rates give the results of the utils functions"""
+
+    # arrange
+    rates = np.array([0., 0.0195, 0.0215, 0.05])
+    monthly = get_monthly_rate(rates)
+    payment = get_annuity_payment(monthly, 240, 150000., 50000.)
+
+    # act & assert
+    np.testing.assert_array_equal(table.monthly_rate(rates), monthly)
+    np.testing.assert_allclose(table.payment(150000., rates, 20, fv=50000.), payment,
+                               rtol=1e-12)
+    np.testing.assert_allclose(table.balance(150000., rates, 20, 100, fv=50000.),
+                               get_balance_after(monthly, 100, 150000., payment),
+                               rtol=1e-12)
+    assert np.all(table.balance(150000., rates, 20, 240) == 0.)
+
+
+def test_annuity_table_interpolates_between_grid(table):
+    """rates between basis points are interpolated closely"""
+
+    rates = np.array([0.02155, 0.0215, 0.04999])
+    expected = get_annuity_payment(get_monthly_rate(rates), 360, 200000.)
+    assert table.payment(200000., rates[0], 30) == pytest.approx(expected[0], abs=1e-3)
+    np.testing.assert_allclose(table.payment(200000., rates, 30), expected, atol=1e-3)
+    assert table.payment(200000., rates, 30)[1] == table.payment(200000., 0.0215, 30)
+
+
+def test_annuity_table_outside_grid(table):
+    """rates outside the grid and terms not in the table are not supported"""
+
+    with pytest.raises(ValueError):
+        table.annuity_factor(0.06, 10)
+    with pytest.raises(ValueError):
+        table.annuity_factor([0.02, 0.0501], 10)
+    with pytest.raises(ValueError):
+        table.annuity_factor(0.02, 15)
+    with pytest.raises(ValueError):
+        table.annuity_factor(0.02, [10, 40])
+    for period in (-1, 121, 461):
+        with pytest.raises(ValueError):
+            table.balance(1000., 0.02, 10, period)
+    with pytest.raises(ValueError):
+        table.balance(1000., 0.02, [10, 20], [120, 241])
+
+
+def test_annuity_table_batch_equals_formulas(table):
+    """a batch of quoted rates, terms and periods gives the formula results"""
+
+    # arrange
+    rng = np.random.default_rng(0)
+    rates = rng.integers(0, 501, 10000) / 10000
+    terms = rng.choice([10, 20, 30], 10000)
+    periods = rng.integers(0, 121, 10000)
+    amounts = rng.uniform(1e5, 5e5, 10000)
+    monthly = get_monthly_rate(rates)
+    payment = get_annuity_payment(monthly, terms * 12, amounts)
+
+    # act & assert
+    np.testing.assert_allclose(table.payment(amounts, rates, terms), payment,
+                               rtol=1e-12)
+    np.testing.assert_allclose(table.balance(amounts, rates, terms, periods),
+                               get_balance_after(monthly, periods, amounts, payment),
+                               rtol=1e-9, atol=1e-6)
+
+
+def test_annuity_table_save_load_memory_mapped(table, tmp_path):
+    """a saved table is loaded memory-mapped and gives the same results"""
+
+    # act
+    table.save(str(tmp_path))
+    loaded = AnnuityTable.load(str(tmp_path))
+
+    # assert
+    assert isinstance(loaded.balance_factors, np.memmap)
+    assert not loaded.balance_factors.flags.writeable
+    assert loaded.payment(1000., 0.031, 10) == table.payment(1000., 0.031, 10)
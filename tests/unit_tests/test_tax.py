@@ -0,0 +1,103 @@
+"""
+tests for the net cost computation in mortgage_scenarios.tax
+"""
+import numpy as np
+import pytest
+
+from mortgage_scenarios import LoanPartIterator, MortgageLoanRunner
+from mortgage_scenarios.batch import YearlyPayments, batch_group_by_year, \
+    batch_payments, batch_to_dataframe
+from mortgage_scenarios.core import group_by_year
+from mortgage_scenarios.tax import TaxRules, TaxYear, compute_net_cost
+
+simple_rules = TaxRules({
+    2020: TaxYear(brackets=((0., 0.4), (50000., 0.5)), max_deduction_rate=0.45,
+                  ewf_rate=0.005, hillen_rate=0.5),
+    2022: TaxYear(brackets=((0., 0.4), (50000., 0.5)), max_deduction_rate=0.4,
+                  ewf_rate=0.005, hillen_rate=0.5),
+})
+
+
+def _yearly(interest, years=(2020, 2021, 2022)):
+    """full years with a monthly interest and payment of 1000 more"""
+    interest = np.asarray(interest, dtype=float)
+    shape = np.broadcast(interest, np.empty(len(years))).shape
+    zeros = np.zeros(shape)
+    return YearlyPayments(years=np.array(years), amount=zeros,
+                          payment=interest + 1000, repayment=zeros + 1000,
+                          interest=interest + zeros, amount_end=zeros,
+                          months=np.full(shape, 12))
+
+
+def test_compute_net_cost_deduction_rates():
+    """the deduction uses the bracket rates capped at the max deduction rate"""
+
+    # arrange: yearly interest 12000, ewf 2000 -> deduction 10000
+    yearly = _yearly([[1000.], [1000.]])
+    income = np.array([[30000.], [100000.]])
+
+    # act
+    net_cost = compute_net_cost(yearly, woz=400000., income=income,
+                                rules=simple_rules)
+
+    # assert
+    assert net_cost.deduction == pytest.approx(10000.)
+    assert net_cost.tax_benefit[0] == pytest.approx([4000., 4000., 4000.])
+    assert net_cost.tax_benefit[1] == pytest.approx([4500., 4500., 4000.])
+    assert net_cost.net_payment[1, 0] == pytest.approx(2000 - 4500 / 12)
+
+
+def test_compute_net_cost_wet_hillen():
+    """an eigenwoningforfait above the interest is partly added to the income"""
+
+    # arrange: yearly interest 1200, ewf 2000 -> addition 800 * 0.5
+    yearly = _yearly(100.)
+
+    # act
+    net_cost = compute_net_cost(yearly, woz=400000., income=60000.,
+                                rules=simple_rules)
+
+    # assert
+    assert net_cost.deduction == pytest.approx(-400.)
+    assert net_cost.tax_benefit == pytest.approx(-200.)
+
+
+def test_tax_rules_year_before_first_year():
+    """years before the first configured year are not supported"""
+
+    with pytest.raises(KeyError):
+        simple_rules.get(2019)
+
+
+@pytest.mark.parametrize('start_year_month', ['2020-01', '2020-10'])
+def test_compute_net_cost_from_group_by_year(start_year_month):
+    """the dataframe of group_by_year gives the same result as the batch engine"""
+
+    # arrange
+    runner = MortgageLoanRunner()
+    runner.add_loanpart(LoanPartIterator(300000., 0.003, 36))
+    runner.step_all()
+    df_yearly = group_by_year(runner.to_dataframe(), start_year_month)
+    yearly = batch_group_by_year(batch_payments(300000., 0.003, 36), start_year_month)
+
+    # act
+    net_cost = compute_net_cost(df_yearly, woz=400000., income=60000.,
+                                rules=simple_rules, start_year_month=start_year_month,
+                                n_periods=36)
+    expected = compute_net_cost(yearly, woz=400000., income=60000.,
+                                rules=simple_rules)
+
+    # assert
+    assert net_cost.years.tolist() == yearly.years.tolist()
+    assert net_cost.interest == pytest.approx(expected.interest)
+    assert net_cost.tax_benefit == pytest.approx(expected.tax_benefit)
+    assert net_cost.net_payment == pytest.approx(expected.net_payment)
+
+
+def test_compute_net_cost_dataframe_requires_months():
+    """the months of a group_by_year dataframe cannot be guessed"""
+
+    df_yearly = group_by_year(batch_to_dataframe(batch_payments(1000., 0.003, 12)),
+                              '2020-10')
+    with pytest.raises(ValueError):
+        compute_net_cost(df_yearly, woz=400000., income=60000., rules=simple_rules)
@@ -0,0 +1,90 @@
+"""
+tests for the differential validation harness in mortgage_scenarios.validation
+"""
+from itertools import islice
+
+import numpy as np
+
+from mortgage_scenarios.core import generate_payments
+from mortgage_scenarios.validation import DEFAULT_ENGINES, Engine, random_cases, \
+    reference_payments, reference_cents_payments, validate_engines, _run_batch
+
+
+def test_validate_engines_passes():
+    """all engines stay within their tolerance of the reference runner"""
+
+    # act
+    report = validate_engines(n_loans=40, max_periods=120, seed=3)
+
+    # assert
+    df = report.to_dataframe()
+    assert report.passed
+    assert list(df.index) == ['batch', 'cents', 'chunked_float32', 'yearly']
+    assert df.loc['batch', 'max_deviation'] == 0.
+    assert np.all(df['speedup'] > 0)
+
+
+def test_reference_payments_drops_trailing_period():
+    """the reference has npers periods, without the extra item of generate_payments"""
+
+    # arrange
+    case = {column: values[0] for column, values in random_cases(1, 1, seed=4).items()}
+    case['change_period'] = case['npers']
+    npers = int(case['npers'][0])
+    items = list(generate_payments(case['amount'][0], case['rate'][0], npers,
+                                   case['fv'][0], case['fixed'][0]))
+
+    # act
+    df = reference_payments(case)
+
+    # assert
+    assert len(items) == npers + 1
+    assert len(df) == npers
+    np.testing.assert_array_equal(df['interest'].values,
+                                  [item.interest for item in islice(items, npers)])
+
+
+def test_validate_engines_shrinks_failing_case():
+    """an engine that ignores the fixed amount is shrunk to a single loanpart"""
+
+    # arrange
+    engine = Engine('no_fixed', lambda cases, n_periods: _run_batch(
+        dict(cases, fixed=np.zeros_like(cases['fixed'])), n_periods), 1e-6)
+
+    # act
+    report = validate_engines(n_loans=20, max_periods=60, seed=5, engines=[engine])
+
+    # assert
+    result = report.results[0]
+    assert not report.passed
+    case = result.failing_case
+    assert len(case['amount']) == 1
+    assert case['npers'][0] == 1 and case['fixed'][0] > 0
+    assert case['fv'][0] == 0 and case['change_period'][0] == case['npers'][0]
+
+
+def test_validate_engines_float32_tolerance_scales_with_amounts():
+    """float32 storage passes on large mortgages of many loanparts"""
+
+    # act
+    report = validate_engines(n_loans=200, n_parts=4, seed=1, shrink=False,
+                              engines=[DEFAULT_ENGINES[2]])
+
+    # assert
+    assert report.results[0].name == 'chunked_float32'
+    assert report.passed
+
+
+def test_reference_cents_detects_missing_rounding():
+    """an engine without rounding per period fails against the cents reference"""
+
+    # arrange
+    engine = Engine('float_as_cents', _run_batch, 1e-6,
+                    reference=reference_cents_payments)
+
+    # act
+    report = validate_engines(n_loans=20, max_periods=60, seed=6, engines=[engine],
+                              shrink=False)
+
+    # assert
+    assert report.results[0].n_failed > 0